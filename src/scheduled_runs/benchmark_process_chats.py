@@ -0,0 +1,90 @@
+"""Offline benchmark of finding the full conversations of a day of chat snapshots (see ProcessChats).
+
+It generates a synthetic day of snapshots in the old format (after every answer the conversation so far), times
+shared.chat_records.full_conversations on it and, for days up to --reference-max snapshots, checks that its output is
+identical to that of the former pairwise substring implementation (and times that too). Example:
+
+    python src/scheduled_runs/benchmark_process_chats.py --snapshots 1000 10000 50000
+"""
+import argparse
+import random
+import time
+
+from shared.chat_records import full_conversations
+
+INITIAL_MESSAGE = {"role": "assistant", "content": "Waar kan ik je mee helpen?"}
+WORDS = "huurder woning reparatie contract huur betaling sleutel melding lekkage verwarming parkeren opzeggen".split()
+
+
+def find_full_conversations_pairwise(json_files: list[dict]) -> list[dict]:
+    """The former implementation of ProcessChats.find_full_conversations, quadratic in the number of snapshots."""
+    conversations_in_list = []
+    for data in json_files:
+        messages = [message["content"] for message in data["conversation"]]
+        messages_conc = " ".join(messages)
+        conversations_in_list.append(messages_conc)
+
+    to_delete = []
+    for i in range(len(conversations_in_list)):
+        for j in range(i + 1, len(conversations_in_list)):
+            if conversations_in_list[i] in conversations_in_list[j]:
+                to_delete.append(i)
+            elif conversations_in_list[j] in conversations_in_list[i]:
+                to_delete.append(j)
+
+    return [json_files[i] for i in range(len(json_files)) if i not in to_delete]
+
+
+def synthetic_day(nr_snapshots: int, seed: int = 0) -> list[dict]:
+    """Snapshots of sessions with one or more conversations ('Start nieuwe chat'), ordered by time of the last chat."""
+    rng = random.Random(seed)
+    snapshots = []
+    session_nr = 0
+    while len(snapshots) < nr_snapshots:
+        session_nr += 1
+        session_uuid = f"20240101{rng.randrange(80000, 180000):06d}_{session_nr:08x}"
+        seconds = rng.randrange(8 * 3600, 18 * 3600)
+        for _ in range(rng.choice([1, 1, 1, 2, 3])):
+            conversation = [INITIAL_MESSAGE]
+            for turn in range(rng.randint(1, 8)):
+                question = f"Vraag {turn + 1} van sessie {session_nr}: " + " ".join(rng.choices(WORDS, k=12)) + "?"
+                answer = " ".join(rng.choices(WORDS, k=rng.randint(40, 120))) + "."
+                conversation = conversation + [
+                    {"role": "user", "content": question},
+                    {"role": "assistant", "content": answer},
+                ]
+                seconds += rng.randint(10, 120)
+                snapshots.append(
+                    {
+                        "session_uuid": session_uuid,
+                        "timestamp_last_chat": f"2024-01-01 {seconds // 3600 % 24:02d}:{seconds // 60 % 60:02d}:"
+                        f"{seconds % 60:02d}",
+                        "conversation": conversation,
+                    }
+                )
+    snapshots = snapshots[:nr_snapshots]
+    return sorted(snapshots, key=lambda snapshot: snapshot["timestamp_last_chat"])
+
+
+def timed(function, snapshots: list[dict]) -> tuple[list[dict], float]:
+    """Output of function on the snapshots, and the time it took in seconds."""
+    start = time.perf_counter()
+    output = function(snapshots)
+    return output, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--snapshots", type=int, nargs="+", default=[1000, 2000, 10_000, 50_000])
+    parser.add_argument("--reference-max", type=int, default=2000, help="Largest day to run the former version on")
+    args = parser.parse_args()
+
+    print(f"{'snapshots':>10}{'full':>8}{'linear (s)':>12}{'pairwise (s)':>14}{'identical':>11}")
+    for nr_snapshots in args.snapshots:
+        snapshots = synthetic_day(nr_snapshots)
+        output, seconds = timed(full_conversations, snapshots)
+        pairwise_seconds, identical = "-", "-"
+        if nr_snapshots <= args.reference_max:
+            reference, reference_seconds = timed(find_full_conversations_pairwise, snapshots)
+            pairwise_seconds, identical = f"{reference_seconds:.2f}", str(output == reference)
+        print(f"{nr_snapshots:>10}{len(output):>8}{seconds:>12.3f}{pairwise_seconds:>14}{identical:>11}")
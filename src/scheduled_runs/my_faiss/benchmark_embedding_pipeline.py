@@ -0,0 +1,107 @@
+"""Offline benchmark of the embedding stage of the FAISS build.
+
+A fake embeddings backend imitates Azure OpenAI (fixed latency per request, HTTP 429 when too many requests are in
+flight), so the serial and the concurrent pipeline can be compared without using the API quota. Example:
+
+    python src/scheduled_runs/my_faiss/benchmark_embedding_pipeline.py --chunks 2000 --latency 0.3
+"""
+import argparse
+import hashlib
+import threading
+import time
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+
+from scheduled_runs.my_faiss.embedding_pipeline import ConcurrentEmbeddings
+
+
+class FakeRateLimitError(Exception):
+    """Imitates openai.RateLimitError."""
+
+    status_code = 429
+
+
+class FakeAzureEmbeddings(Embeddings):
+    """Deterministic embeddings with the latency and rate limiting of a remote API."""
+
+    def __init__(self, size: int = 1536, latency: float = 0.3, max_parallel_requests: int = 8):
+        """Initialize the fake backend."""
+        self.size = size
+        self.latency = latency
+        self.max_parallel_requests = max_parallel_requests
+        self.in_flight = 0
+        self.nr_requests = 0
+        self.nr_rate_limited = 0
+        self.lock = threading.Lock()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        """Return a vector per text after waiting for the simulated network latency."""
+        with self.lock:
+            self.nr_requests += 1
+            if self.in_flight >= self.max_parallel_requests:
+                self.nr_rate_limited += 1
+                raise FakeRateLimitError("Too many requests")
+            self.in_flight += 1
+        try:
+            time.sleep(self.latency)
+            return [self._vector(text) for text in texts]
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def embed_query(self, text: str) -> list[float]:
+        """Return the vector of a single text."""
+        return self.embed_documents([text])[0]
+
+    def _vector(self, text: str) -> list[float]:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        return np.random.default_rng(seed).random(self.size, dtype=np.float32).tolist()
+
+
+def fake_chunks(nr_chunks: int) -> list[Document]:
+    """Chunks of roughly the size the builder produces (~700 tokens)."""
+    return [
+        Document(page_content=f"Titel van artikel: artikel {i}\n\n" + "huur opzeggen woning " * 230, metadata={"id": i})
+        for i in range(nr_chunks)
+    ]
+
+
+def build_index(embeddings: Embeddings, chunks: list[Document]) -> tuple[float, float]:
+    """Build a FAISS index and return the total build time and the throughput in chunks per second."""
+    start = time.perf_counter()
+    FAISS.from_documents(chunks, embeddings)
+    seconds = time.perf_counter() - start
+    return seconds, len(chunks) / seconds
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.3, help="Simulated seconds per request")
+    parser.add_argument("--max-parallel-requests", type=int, default=8, help="Above this the fake API returns 429")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--tokens-per-minute", type=int, default=10_000_000)
+    args = parser.parse_args()
+
+    chunks = fake_chunks(args.chunks)
+
+    def count_tokens(text):
+        """Rough estimate, avoids downloading the tiktoken encoding."""
+        return len(text) // 4
+
+    backend = FakeAzureEmbeddings(latency=args.latency, max_parallel_requests=args.max_parallel_requests)
+    print(f"{'pipeline':<24}{'build time (s)':>16}{'chunks/s':>12}{'requests':>10}{'429s':>8}")
+    for concurrency in args.concurrency:
+        backend.nr_requests = backend.nr_rate_limited = 0
+        pipeline = ConcurrentEmbeddings(
+            backend,
+            max_concurrency=concurrency,
+            tokens_per_minute=args.tokens_per_minute,
+            count_tokens=count_tokens,
+        )
+        seconds, throughput = build_index(pipeline, chunks)
+        name = f"concurrent ({concurrency})"
+        print(f"{name:<24}{seconds:>16.2f}{throughput:>12.1f}{backend.nr_requests:>10}{backend.nr_rate_limited:>8}")
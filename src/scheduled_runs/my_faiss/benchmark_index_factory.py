@@ -0,0 +1,85 @@
+"""Offline benchmark of the faiss index types the builder can create (see index_factory.py).
+
+For every index factory spec it measures the build (training) time, recall@k against the exact flat index and the
+p50/p99 latency of a single query at the k values offered in the sidebar of the webapp. It uses the vectors of an index
+in data/faiss when given, otherwise synthetic clustered vectors the size of ada-002 embeddings. Example:
+
+    python src/scheduled_runs/my_faiss/benchmark_index_factory.py --vectors 50000 --specs Flat HNSW32 IVF256,PQ48
+    python src/scheduled_runs/my_faiss/benchmark_index_factory.py --faiss-index data/faiss/index.faiss
+"""
+import argparse
+import time
+
+import faiss
+import numpy as np
+
+from scheduled_runs.my_faiss.index_factory import build_index
+
+SIDEBAR_K_VALUES = [3, 4, 5, 7]
+
+
+def synthetic_vectors(nr_vectors: int, size: int = 1536, nr_clusters: int = 200, seed: int = 0) -> np.ndarray:
+    """Normalized vectors around random cluster centers, a rough imitation of the embeddings of articles."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((nr_clusters, size), dtype=np.float32)
+    vectors = centers[rng.integers(nr_clusters, size=nr_vectors)]
+    vectors += 0.5 * rng.standard_normal((nr_vectors, size), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def index_vectors(path: str) -> np.ndarray:
+    """All vectors of an existing (flat or HNSW) faiss index."""
+    index = faiss.read_index(path)
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def queries_from(vectors: np.ndarray, nr_queries: int, seed: int = 1) -> np.ndarray:
+    """Queries close to, but not identical to, vectors in the index."""
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.integers(len(vectors), size=nr_queries)].copy()
+    queries += 0.02 * rng.standard_normal(queries.shape, dtype=np.float32)
+    return queries
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray, k: int) -> float:
+    """Fraction of the exact k nearest neighbours that the index returns in its top k."""
+    hits = sum(len(set(found_row[:k]) & set(truth_row[:k])) for found_row, truth_row in zip(found, truth))
+    return hits / (k * len(truth))
+
+
+def latency_percentiles(index: faiss.Index, queries: np.ndarray, k: int) -> tuple[float, float]:
+    """p50 and p99 latency in milliseconds of searching one query at a time, like the webapp does."""
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        index.search(query[None, :], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return float(np.percentile(latencies, 50)), float(np.percentile(latencies, 99))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--faiss-index", help="Benchmark on the vectors of this index instead of synthetic vectors")
+    parser.add_argument("--vectors", type=int, default=20_000, help="Number of synthetic vectors")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--specs", nargs="+", default=["Flat", "HNSW32", "IVF256,Flat", "IVF256,PQ48"])
+    parser.add_argument("--threads", type=int, default=1, help="faiss OpenMP threads (the webapp searches with 1)")
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(args.threads)
+    vectors = index_vectors(args.faiss_index) if args.faiss_index else synthetic_vectors(args.vectors)
+    queries = queries_from(vectors, args.queries)
+    k_max = max(SIDEBAR_K_VALUES)
+    _, truth = build_index(vectors, "Flat").search(queries, k_max)
+    print(f"{len(vectors)} vectors of size {vectors.shape[1]}, {len(queries)} queries")
+
+    print(f"{'index':<16}{'build (s)':>10}{'k':>4}{'recall@k':>10}{'p50 (ms)':>10}{'p99 (ms)':>10}")
+    for spec in args.specs:
+        start = time.perf_counter()
+        index = build_index(vectors, spec)
+        build_seconds = time.perf_counter() - start
+        _, found = index.search(queries, k_max)
+        for k in SIDEBAR_K_VALUES:
+            p50, p99 = latency_percentiles(index, queries, k)
+            recall = recall_at_k(found, truth, k)
+            print(f"{spec:<16}{build_seconds:>10.1f}{k:>4}{recall:>10.3f}{p50:>10.3f}{p99:>10.3f}")
@@ -0,0 +1,124 @@
+import hashlib
+import sqlite3
+import time
+from pathlib import Path
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from scheduled_runs.runlogging import logger
+
+MAX_CACHE_SIZE_MB = 500
+SQLITE_BATCH_SIZE = 500  # stay below the maximum number of host parameters in a SQLite query
+
+
+class EmbeddingCache:
+    """Content-addressed cache of embeddings, stored in a SQLite file.
+
+    The key is a hash of the embedding model, the API version and the text. Vectors are stored as raw float32 bytes.
+    When the cache grows beyond max_size_mb, the least recently used vectors are evicted.
+    """
+
+    def __init__(self, path: str | Path, model: str, api_version: str, max_size_mb: int = MAX_CACHE_SIZE_MB):
+        """Open (or create) the cache file."""
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.model = model
+        self.api_version = api_version
+        self.max_size_bytes = max_size_mb * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings "
+            "(key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings (last_used)")
+        self.conn.commit()
+
+    def key(self, text: str) -> str:
+        """Hash of model, API version and text."""
+        return hashlib.sha256(f"{self.model}\n{self.api_version}\n{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, texts: list[str]) -> list[list[float] | None]:
+        """Look up the embeddings of the texts; None for texts that are not in the cache."""
+        keys = [self.key(text) for text in texts]
+        found = {}
+        for start in range(0, len(keys), SQLITE_BATCH_SIZE):
+            end = start + SQLITE_BATCH_SIZE
+            batch = keys[start:end]
+            placeholders = ",".join("?" * len(batch))
+            rows = self.conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch)
+            for key, vector in rows:
+                found[key] = np.frombuffer(vector, dtype=np.float32).tolist()
+            self.conn.execute(
+                f"UPDATE embeddings SET last_used = ? WHERE key IN ({placeholders})", [time.time(), *batch]
+            )
+        self.conn.commit()
+
+        results = [found.get(key) for key in keys]
+        nr_hits = sum(result is not None for result in results)
+        self.hits += nr_hits
+        self.misses += len(results) - nr_hits
+        return results
+
+    def put_many(self, texts: list[str], vectors: list[list[float]]) -> None:
+        """Store embeddings in the cache."""
+        now = time.time()
+        rows = [
+            (self.key(text), np.asarray(vector, dtype=np.float32).tobytes(), now)
+            for text, vector in zip(texts, vectors)
+        ]
+        self.conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", rows)
+        self.conn.commit()
+
+    def evict(self) -> int:
+        """Remove the least recently used embeddings until the cache fits within the size cap."""
+        cursor = self.conn.execute(
+            """
+            DELETE FROM embeddings WHERE key IN (
+                SELECT key FROM (
+                    SELECT key, SUM(LENGTH(vector)) OVER (ORDER BY last_used DESC, key) AS cumulative_size
+                    FROM embeddings
+                )
+                WHERE cumulative_size > ?
+            )
+            """,
+            (self.max_size_bytes,),
+        )
+        self.conn.commit()
+        if cursor.rowcount > 0:
+            logger.info(f"Evicted {cursor.rowcount} embeddings from the cache.")
+        return cursor.rowcount
+
+    def close(self, compact: bool = True) -> None:
+        """Close the cache file; with compact it is evicted and compacted first, so it can be uploaded."""
+        if compact:
+            self.evict()
+            self.conn.execute("VACUUM")
+        self.conn.close()
+        logger.info(f"Embedding cache hits: {self.hits}, misses: {self.misses}")
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings that are looked up in an EmbeddingCache first; only missing texts are sent to the API."""
+
+    def __init__(self, underlying: Embeddings, cache: EmbeddingCache):
+        """Wrap the underlying embeddings with the cache."""
+        self.underlying = underlying
+        self.cache = cache
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        """Embed the texts, using cached embeddings where available."""
+        vectors = self.cache.get_many(texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            new_vectors = self.underlying.embed_documents([texts[i] for i in missing])
+            self.cache.put_many([texts[i] for i in missing], new_vectors)
+            for i, vector in zip(missing, new_vectors):
+                vectors[i] = vector
+        return vectors
+
+    def embed_query(self, text: str) -> list[float]:
+        """Embed a query (not cached)."""
+        return self.underlying.embed_query(text)
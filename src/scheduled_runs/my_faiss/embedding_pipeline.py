@@ -0,0 +1,104 @@
+import random
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+
+import tiktoken
+from langchain_core.embeddings import Embeddings
+
+from scheduled_runs.runlogging import logger
+
+BATCH_SIZE = 16  # maximum number of inputs per request for Azure OpenAI embeddings
+MAX_CONCURRENCY = 4
+TOKENS_PER_MINUTE = 240_000  # quota of the embeddings deployment
+MAX_RETRIES = 6
+
+
+def count_tokens_cl100k(text: str) -> int:
+    """Count tokens the way the embedding model does."""
+    return len(tiktoken.get_encoding("cl100k_base").encode(text))
+
+
+class TokenBudget:
+    """Token bucket that spreads requests out over time so the tokens-per-minute quota is not exceeded."""
+
+    def __init__(self, tokens_per_minute: int):
+        """Start with a full bucket."""
+        self.capacity = tokens_per_minute
+        self.available = float(tokens_per_minute)
+        self.refill_per_second = tokens_per_minute / 60
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: int) -> None:
+        """Block until the tokens are available and take them from the bucket."""
+        tokens = min(tokens, self.capacity)  # a single batch larger than the quota can never fit otherwise
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.available = min(self.capacity, self.available + (now - self.last_refill) * self.refill_per_second)
+                self.last_refill = now
+                if self.available >= tokens:
+                    self.available -= tokens
+                    return
+                wait = (tokens - self.available) / self.refill_per_second
+            time.sleep(wait)
+
+
+class ConcurrentEmbeddings(Embeddings):
+    """Embed documents in batches that are sent concurrently to the underlying embeddings.
+
+    Requests are throttled with a token budget, and batches that hit the rate limit (HTTP 429) are retried with
+    exponential backoff. The vectors are returned in the same order as the texts.
+    """
+
+    def __init__(
+        self,
+        underlying: Embeddings,
+        batch_size: int = BATCH_SIZE,
+        max_concurrency: int = MAX_CONCURRENCY,
+        tokens_per_minute: int = TOKENS_PER_MINUTE,
+        max_retries: int = MAX_RETRIES,
+        count_tokens: Callable[[str], int] = count_tokens_cl100k,
+    ):
+        """Initialize the pipeline around the underlying embeddings."""
+        self.underlying = underlying
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.budget = TokenBudget(tokens_per_minute)
+        self.max_retries = max_retries
+        self.count_tokens = count_tokens
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        """Embed the texts batch by batch, with at most max_concurrency batches in flight."""
+        batches = []
+        for start in range(0, len(texts), self.batch_size):
+            end = start + self.batch_size
+            batches.append(texts[start:end])
+        logger.info(f"Embedding {len(texts)} texts in {len(batches)} batches (concurrency {self.max_concurrency}).")
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            results = list(executor.map(self._embed_batch, batches))
+        return [vector for batch_vectors in results for vector in batch_vectors]
+
+    def embed_query(self, text: str) -> list[float]:
+        """Embed a single query."""
+        return self.underlying.embed_query(text)
+
+    def _embed_batch(self, batch: list[str]) -> list[list[float]]:
+        """Embed one batch, retrying with exponential backoff when the rate limit is hit."""
+        self.budget.acquire(sum(self.count_tokens(text) for text in batch))
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.underlying.embed_documents(batch)
+            except Exception as e:
+                if not _is_rate_limit_error(e) or attempt == self.max_retries:
+                    raise
+                wait = min(60, 2**attempt) + random.uniform(0, 1)
+                logger.warning(f"Rate limit hit, retrying batch in {wait:.1f} seconds (attempt {attempt + 1}).")
+                time.sleep(wait)
+
+
+def _is_rate_limit_error(e: Exception) -> bool:
+    """Recognize HTTP 429 errors (openai.RateLimitError has status_code 429)."""
+    return getattr(e, "status_code", None) == 429
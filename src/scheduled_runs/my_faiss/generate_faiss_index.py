@@ -1,20 +1,42 @@
+import argparse
 import os
+import tempfile
 from datetime import datetime
 from pathlib import Path
 
 from azure.identity import DefaultAzureCredential
 from azure.storage.blob import ContainerClient
+from langchain.docstore.document import Document
 from langchain.text_splitter import TokenTextSplitter
 from langchain_community.vectorstores import FAISS
 from langchain_openai import AzureOpenAIEmbeddings
 
-from scheduled_runs.my_faiss.get_articles import get_all_articles
+from scheduled_runs.my_faiss.embedding_cache import CachedEmbeddings, EmbeddingCache
+from scheduled_runs.my_faiss.embedding_pipeline import ConcurrentEmbeddings
+from scheduled_runs.my_faiss.get_articles import ArticleSync, ArticleWatermark
+from scheduled_runs.my_faiss.index_factory import (
+    FLAT,
+    build_vectorstore,
+    default_search_parameters,
+)
+from scheduled_runs.my_faiss.index_manifest import (
+    ArticleEntry,
+    IndexManifest,
+    article_hash,
+)
 from scheduled_runs.runlogging import logger
+from shared.chunk_store import load_faiss_in_memory, save_faiss
 
 EMBEDDINGS_MODEL = "webapps-text-embedding-ada-002"
 OPENAI_API_VERSION = "2024-10-21"
 NAME_FOLDER = "klantenservice-chatbot-medewerker"
 LOCAL_NAME_SUBFOLDER_FAISS_INDEX = "data/faiss"
+CHUNK_SIZE = 700
+CHUNK_OVERLAP = 70
+LOCAL_PATH_EMBEDDING_CACHE = "data/embedding_cache/embeddings.sqlite"
+BLOB_PATH_EMBEDDING_CACHE = f"{NAME_FOLDER}/embedding-cache/embeddings.sqlite"  # shared by tst and acc
+NAME_WATERMARK = "faiss-sync/watermark.json"
+INDEX_FACTORY = os.environ.get("FAISS_INDEX_FACTORY", FLAT)  # e.g. Flat, HNSW32 or IVF256,PQ48
 
 
 class CreateFAISSIndex:
@@ -31,10 +53,21 @@ class CreateFAISSIndex:
         azure_endpoint=os.environ["OPENAI_ENDPOINT"],
     )
 
-    def __init__(self, environment: str = "tst"):
-        """Initialize CreateFAISSIndex with environment and FAISS DB."""
+    def __init__(self, environment: str = "tst", incremental: bool = True, index_factory: str = INDEX_FACTORY):
+        """Initialize CreateFAISSIndex with environment and FAISS DB.
+
+        With incremental=True the previous index is updated: only new or changed articles are embedded and the chunks
+        of removed articles are deleted. Otherwise the index is rebuilt from scratch. index_factory is the faiss index
+        factory spec of the index type to build.
+        """
         self.environment = environment
+        self.incremental = incremental
+        self.index_factory = index_factory
         self.faiss_db = None
+        self.manifest = None
+        self.embeddings = ConcurrentEmbeddings(CreateFAISSIndex.embeddings)
+        self.embedding_cache = None
+        self.watermark = None
 
     @classmethod
     def inspect_faiss(cls):
@@ -42,56 +75,236 @@ class CreateFAISSIndex:
 
         Make sure the Faiss files are inside the data/faiss folder.
         """
-        index_name = list(Path("data/faiss").iterdir())[0].stem
-        faiss_db = FAISS.load_local(folder_path="data/faiss", embeddings=cls.embeddings, index_name=index_name)
+        index_name = next(Path("data/faiss").glob("*.faiss")).stem
+        faiss_db = load_faiss_in_memory("data/faiss", index_name, cls.embeddings)
         docs = faiss_db.similarity_search(query="", fetch_k=100000, k=100000)
         titles = [d.metadata["source"] for d in docs]
         return docs, titles
 
     def run_all_steps(self) -> None:
         """Run all steps for generating and saving FAISS index."""
-        self._generate_embeddings_and_vectorstore()
+        manifest = IndexManifest(
+            embeddings_model=EMBEDDINGS_MODEL,
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP,
+            index_factory=self.index_factory,
+            search_parameters=default_search_parameters(self.index_factory),
+        )
+        docs, sync = self._sync_articles(manifest)
+        # Nothing is downloaded before it is known that the index has to change
+        if not docs and self.watermark == sync.watermark:
+            logger.info("No articles changed since the previous sync, skipping the build.")
+            return
+        self._download_embedding_cache()
+        if not self._generate_embeddings_and_vectorstore(manifest, docs, sync):
+            logger.info("No articles changed since the previous index, skipping the build.")
+            self.embedding_cache.close(compact=False)
+            self._upload_watermark()
+            return
         self._save_and_upload_vectorstore()
+        self._upload_embedding_cache()
 
-    def _generate_embeddings_and_vectorstore(self) -> None:
-        """Generate embeddings for all documents in local folder."""
-
-        text_splitter = TokenTextSplitter(encoding_name="cl100k_base", chunk_size=700, chunk_overlap=70)
+    def _sync_articles(self, manifest: IndexManifest) -> tuple[list[Document], ArticleSync]:
+        """List the articles in Helpjuice and get the ones that are new or updated since the previous sync."""
+        sync = ArticleSync(self._download_watermark() if self.incremental else None)
         logger.info("Getting articles from Helpjuice API")
-        docs = get_all_articles()
-        logger.info(f"Number of docs after filter (to put in vectorstore): {len(docs)}")
-        if len(docs) < 100:
+        docs = list(sync.changed_articles())
+        logger.info(f"Number of docs after filter (to put in vectorstore): {len(sync.listing)}")
+        if len(sync.listing) < 100:
             raise Exception("Expected more articles in Helpjuice?")
-        doc_chunks = text_splitter.split_documents(docs)
-        for doc in doc_chunks:
-            doc.page_content = "Titel van artikel: " + doc.metadata["source"] + "\n\n" + doc.page_content
-        logger.info("Start generating embeddings and vectorstore.")
-        self.faiss_db = FAISS.from_documents(doc_chunks, CreateFAISSIndex.embeddings)
-        self.faiss_db.save_local(f"{LOCAL_NAME_SUBFOLDER_FAISS_INDEX}")
-        return
+        self.watermark = sync.updated_watermark().model_copy(update={"index_settings": manifest.settings()})
+        return docs, sync
 
-    def _save_and_upload_vectorstore(self) -> None:
-        """Save vectorstore to local folder and upload to Azure Data Lake."""
-        logger.info("Uploading vectorstore.")
-        name_storage = os.environ["DATALAKE_NAME_PRD"] if self.environment == "prd" else os.environ["DATALAKE_NAME_DEV"]
+    def _download_embedding_cache(self) -> None:
+        """Download the embedding cache of previous runs, so unchanged chunks don't have to be embedded again."""
+        client = self._container_client()
+        Path(LOCAL_PATH_EMBEDDING_CACHE).parent.mkdir(parents=True, exist_ok=True)
+        blob_client = client.get_blob_client(BLOB_PATH_EMBEDDING_CACHE)
+        if blob_client.exists():
+            logger.info("Downloading embedding cache.")
+            with open(LOCAL_PATH_EMBEDDING_CACHE, "wb") as f:
+                blob_client.download_blob().readinto(f)
+        self.embedding_cache = EmbeddingCache(LOCAL_PATH_EMBEDDING_CACHE, EMBEDDINGS_MODEL, OPENAI_API_VERSION)
+        self.embeddings = CachedEmbeddings(ConcurrentEmbeddings(CreateFAISSIndex.embeddings), self.embedding_cache)
+
+    def _upload_embedding_cache(self) -> None:
+        """Evict old embeddings from the cache and upload it for the next run."""
+        self.embedding_cache.close()
+        client = self._container_client()
+        with open(LOCAL_PATH_EMBEDDING_CACHE, "rb") as data:
+            client.upload_blob(name=BLOB_PATH_EMBEDDING_CACHE, data=data, overwrite=True)
+        logger.info("Uploaded embedding cache.")
+
+    def _generate_embeddings_and_vectorstore(
+        self, manifest: IndexManifest, docs: list[Document], sync: ArticleSync
+    ) -> bool:
+        """Generate embeddings for all new or changed documents and update (or create) the vectorstore.
+
+        Returns:
+            bool: False when nothing changed since the previous index (the index is then left as it is).
+        """
+        previous = self._load_previous_vectorstore(manifest) if self.incremental else None
+        previous_manifest = previous[1] if previous is not None else None
+        if previous is None and sync.watermark.max_updated_at is not None:
+            # The sync only gave the articles changed since the watermark, but now every article has to be embedded
+            logger.info("Getting all articles from Helpjuice API")
+            docs = list(ArticleSync().changed_articles())
 
-        client = ContainerClient(
+        changed_ids = []
+        doc_chunks = []
+        chunk_ids = []
+        for doc in docs:
+            if previous_manifest is None or previous_manifest.is_changed(doc):
+                changed_ids.append(str(doc.metadata["id"]))
+                article_chunks, article_chunk_ids = self._split_articles([doc], manifest)
+                doc_chunks.extend(article_chunks)
+                chunk_ids.extend(article_chunk_ids)
+        current_ids = {str(article_id) for article_id in sync.listing}
+
+        if previous is None:
+            logger.info("Start generating embeddings and vectorstore for all articles.")
+            self.faiss_db = build_vectorstore(
+                doc_chunks, chunk_ids, self.embeddings, manifest.index_factory, manifest.search_parameters
+            )
+        else:
+            self.faiss_db = previous[0]
+            removed_ids = previous_manifest.removed_article_ids(current_ids)
+            logger.info(f"Articles new or changed: {len(changed_ids)}, articles removed: {len(removed_ids)}")
+            same_index_type = (previous_manifest.index_factory, previous_manifest.search_parameters) == (
+                manifest.index_factory,
+                manifest.search_parameters,
+            )
+            if not changed_ids and not removed_ids and same_index_type:
+                return False
+
+            stale_chunk_ids = []
+            for article_id in changed_ids + removed_ids:
+                entry = previous_manifest.articles.pop(article_id, None)
+                if entry is not None:
+                    stale_chunk_ids.extend(entry.chunk_ids)
+            manifest.articles = {**previous_manifest.articles, **manifest.articles}
+
+            if manifest.index_factory == FLAT and previous_manifest.index_factory == FLAT:
+                if stale_chunk_ids:
+                    self.faiss_db.delete(stale_chunk_ids)
+                if doc_chunks:
+                    logger.info(f"Start generating embeddings for {len(doc_chunks)} chunks.")
+                    self.faiss_db.add_documents(doc_chunks, ids=chunk_ids)
+            else:
+                # Approximate indexes can't always remove vectors (HNSW) and are trained on the previous data (IVF, PQ),
+                # so they are rebuilt. Only the new chunks are embedded, the others come from the embedding cache.
+                self.faiss_db = self._rebuild_vectorstore(stale_chunk_ids, doc_chunks, chunk_ids, manifest)
+
+        self.manifest = manifest
+        save_faiss(self.faiss_db, LOCAL_NAME_SUBFOLDER_FAISS_INDEX)
+        self.manifest.save(f"{LOCAL_NAME_SUBFOLDER_FAISS_INDEX}/index.json")
+        return True
+
+    def _rebuild_vectorstore(
+        self, stale_chunk_ids: list[str], doc_chunks: list[Document], chunk_ids: list[str], manifest: IndexManifest
+    ) -> FAISS:
+        """Build a new index of the type in the manifest from the chunks of the previous index and the new chunks."""
+        stale_chunk_ids = set(stale_chunk_ids)
+        kept_ids = [
+            chunk_id for chunk_id in self.faiss_db.index_to_docstore_id.values() if chunk_id not in stale_chunk_ids
+        ]
+        kept_chunks = [self.faiss_db.docstore.search(chunk_id) for chunk_id in kept_ids]
+        logger.info(f"Start building a {manifest.index_factory} index of {len(kept_ids) + len(chunk_ids)} chunks.")
+        return build_vectorstore(
+            kept_chunks + doc_chunks,
+            kept_ids + chunk_ids,
+            self.embeddings,
+            manifest.index_factory,
+            manifest.search_parameters,
+        )
+
+    @staticmethod
+    def _split_articles(docs: list[Document], manifest: IndexManifest) -> tuple[list[Document], list[str]]:
+        """Split the articles into chunks with a stable id ({article_id}_{chunk_nr}) and register them in the
+        manifest."""
+        text_splitter = TokenTextSplitter(
+            encoding_name="cl100k_base", chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP
+        )
+        doc_chunks = []
+        chunk_ids = []
+        for doc in docs:
+            article_id = str(doc.metadata["id"])
+            article_chunks = text_splitter.split_documents([doc])
+            ids = [f"{article_id}_{i}" for i in range(len(article_chunks))]
+            for chunk in article_chunks:
+                chunk.page_content = "Titel van artikel: " + chunk.metadata["source"] + "\n\n" + chunk.page_content
+            manifest.articles[article_id] = ArticleEntry(
+                date=doc.metadata["date"], content_hash=article_hash(doc), chunk_ids=ids
+            )
+            doc_chunks.extend(article_chunks)
+            chunk_ids.extend(ids)
+        return doc_chunks, chunk_ids
+
+    def _load_previous_vectorstore(self, manifest: IndexManifest) -> tuple[FAISS, IndexManifest] | None:
+        """Download the most recent index and its manifest.
+
+        Returns None when there is no usable previous index, in which case the index is rebuilt from scratch.
+        """
+        client = self._container_client()
+        prefix = f"{NAME_FOLDER}/{self.environment}/faiss/"
+        names = sorted(name for name in client.list_blob_names(name_starts_with=prefix) if name.endswith(".faiss"))
+        if not names:
+            logger.info("No previous FAISS index found, building a new one.")
+            return None
+        index_name = names[-1].split(prefix)[1].split(".")[0]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for extension in ["faiss", "docs", "json"]:
+                blob_name = f"{prefix}{index_name}.{extension}"
+                if not client.get_blob_client(blob_name).exists():
+                    logger.info(f"Previous index is missing {blob_name}, building a new one.")
+                    return None
+                with open(f"{tmp_dir}/{index_name}.{extension}", "wb") as f:
+                    f.write(client.download_blob(blob_name).readall())
+
+            previous_manifest = IndexManifest.load(f"{tmp_dir}/{index_name}.json")
+            if not previous_manifest.is_compatible(manifest):
+                logger.info("Chunk or embedding settings changed since the previous index, building a new one.")
+                return None
+            faiss_db = load_faiss_in_memory(tmp_dir, index_name, self.embeddings)
+        logger.info(f"Loaded previous index {index_name} with {len(previous_manifest.articles)} articles.")
+        return faiss_db, previous_manifest
+
+    def _download_watermark(self) -> ArticleWatermark | None:
+        """Download the watermark of the previous sync with Helpjuice."""
+        blob_client = self._container_client().get_blob_client(f"{NAME_FOLDER}/{self.environment}/{NAME_WATERMARK}")
+        if not blob_client.exists():
+            logger.info("No watermark of a previous sync found, listing all articles as changed.")
+            return None
+        watermark = ArticleWatermark.model_validate_json(blob_client.download_blob().readall())
+        logger.info(f"Syncing articles updated after {watermark.max_updated_at}.")
+        return watermark
+
+    def _container_client(self) -> ContainerClient:
+        """Initialize container client (datalake, container ds-files)."""
+        name_storage = os.environ["DATALAKE_NAME_PRD"] if self.environment == "prd" else os.environ["DATALAKE_NAME_DEV"]
+        return ContainerClient(
             account_url=f"https://{name_storage}.blob.core.windows.net",
             container_name="ds-files",
             credential=DefaultAzureCredential(),
         )
 
+    def _save_and_upload_vectorstore(self) -> None:
+        """Save vectorstore to local folder and upload to Azure Data Lake."""
+        logger.info("Uploading vectorstore.")
+        client = self._container_client()
+
         # Get current datetime to version the index
         now = datetime.now()
         version = now.strftime("%Y-%m-%d_%H%M")
+        self.manifest.version = version
+        self.manifest.save(f"{LOCAL_NAME_SUBFOLDER_FAISS_INDEX}/index.json")
 
-        logger.info(f"DELETING FAISS FILES {self.environment}")
-        old_index_names = list(client.list_blob_names(name_starts_with=f"{NAME_FOLDER}/{self.environment}/faiss/"))
-        for name in old_index_names:
-            if name.startswith(f"{NAME_FOLDER}/{self.environment}/faiss/"):
-                client.delete_blob(blob=name)
-
-        for name in ["index.faiss", "index.pkl"]:
+        # The .faiss file goes last and the old versions are deleted after it: the webapp only picks a version when all
+        # its files are there, and there always is a complete version to load
+        faiss_folder = f"{NAME_FOLDER}/{self.environment}/faiss/"
+        new_names = []
+        for name in ["index.docs", "index.json", "index.faiss"]:
             name_with_version = f'index_{version}.{name.split(".")[1]}'
             with open(f"{LOCAL_NAME_SUBFOLDER_FAISS_INDEX}/{name}", "rb") as data:
                 client.upload_blob(
@@ -100,16 +313,48 @@ class CreateFAISSIndex:
                     overwrite=True,
                 )
             with open(f"{LOCAL_NAME_SUBFOLDER_FAISS_INDEX}/{name}", "rb") as data:
-                client.upload_blob(
-                    name=f"{NAME_FOLDER}/{self.environment}/faiss/{name_with_version}", data=data, overwrite=True
-                )
-        logger.info(f"uploading complete, uploaded {name_with_version} to {self.environment}")
+                client.upload_blob(name=f"{faiss_folder}{name_with_version}", data=data, overwrite=True)
+            new_names.append(f"{faiss_folder}{name_with_version}")
+        logger.info(f"uploading complete, uploaded index_{version} to {self.environment}")
+
+        logger.info(f"DELETING OLD FAISS FILES {self.environment}")
+        for name in list(client.list_blob_names(name_starts_with=faiss_folder)):
+            if name not in new_names:
+                client.delete_blob(blob=name)
+
+        # Only save the watermark once the index that contains these articles has been uploaded
+        self._upload_watermark()
+
+    def _upload_watermark(self) -> None:
+        """Upload the watermark of this sync with Helpjuice, for the next run."""
+        self._container_client().upload_blob(
+            name=f"{NAME_FOLDER}/{self.environment}/{NAME_WATERMARK}",
+            data=self.watermark.model_dump_json(),
+            overwrite=True,
+        )
 
 
 if __name__ == "__main__":
     # run this to inspect the faiss index:
     # docs, titles = CreateFAISSIndex.inspect_faiss()
 
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--full-rebuild",
+        dest="full_rebuild",
+        action="store_true",
+        help="Embed all articles again instead of updating the previous index.",
+    )
+    parser.add_argument(
+        "--index-factory",
+        dest="index_factory",
+        default=INDEX_FACTORY,
+        help="Faiss index factory spec of the index to build, e.g. Flat, HNSW32 or IVF256,PQ48.",
+    )
+    args = parser.parse_args()
+
     logger.info("Start generating new FAISS index.")
-    fi = CreateFAISSIndex(environment=os.environ["ENVIRONMENT"])
+    fi = CreateFAISSIndex(
+        environment=os.environ["ENVIRONMENT"], incremental=not args.full_rebuild, index_factory=args.index_factory
+    )
     fi.run_all_steps()
@@ -1,15 +1,23 @@
 import datetime
 import os
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import requests
 from langchain.docstore.document import Document
-from pydantic import BaseModel
+from pydantic import BaseModel, TypeAdapter
+from requests.adapters import HTTPAdapter
 from unidecode import unidecode
+from urllib3.util import Retry
 
 from scheduled_runs.runlogging import logger
 
 HELPJUICE_API_KEY = os.environ["HELPJUICE_API_KEY"]
 HELPJUICE_API_URL = os.environ["HELPJUICE_API_URL"]
+MAX_PARALLEL_REQUESTS = 4
+MAX_RETRIES = 5
+REQUEST_TIMEOUT = (10, 300)  # (connect, read) in seconds
+UPDATED_AT_ADAPTER = TypeAdapter(datetime.datetime)  # parses updated_at the same way as Article does
 
 
 class Article(BaseModel):
@@ -35,53 +43,137 @@ def get_all_articles() -> list[Document]:
 
     Maak er Langchain document objecten van.
     """
-    categories = _get_categories()
+    return list(iter_articles())
+
+
+def iter_articles() -> Iterator[Document]:
+    """Haal de artikelen op en geef ze als Langchain documenten terug zodra een pagina binnen is.
+
+    De eerste pagina vertelt hoeveel pagina's er zijn, de overige pagina's worden daarna parallel opgehaald.
+    """
+    session = _session()
+    categories = _get_categories(session)
+    for articles in _iter_article_pages(session):
+        for a in _articles_in_categories(articles, categories):
+            yield _to_document(a)
+
+
+class ArticleWatermark(BaseModel):
+    """State of the kennisbank at the previous sync: the maximum updated_at seen and the ids of all articles."""
+
+    max_updated_at: datetime.datetime | None = None
+    article_ids: list[int] = []
+    index_settings: dict = {}  # settings of the index that was built from the sync (see IndexManifest.settings)
+
+
+class ArticleSync:
+    """Delta sync of the articles against a watermark of the previous sync.
+
+    The Helpjuice /articles endpoint has no filter on updated_at, so every page is listed, but only the articles that
+    are new or updated since the watermark are parsed and returned. The listing holds every article, so articles that
+    are no longer listed can be removed.
+    """
+
+    def __init__(self, watermark: ArticleWatermark | None = None):
+        """Initialize the sync; without a watermark every article counts as changed."""
+        self.watermark = watermark if watermark is not None else ArticleWatermark()
+        self.listing: dict[int, datetime.datetime] = {}  # id -> updated_at of every article, filled while syncing
+
+    def changed_articles(self) -> Iterator[Document]:
+        """Geef de nieuwe en gewijzigde artikelen als Langchain documenten terug zodra hun pagina binnen is."""
+        known_ids = set(self.watermark.article_ids)
+        session = _session()
+        categories = _get_categories(session)
+        for articles in _iter_article_pages(session):
+            for a in _articles_in_categories(articles, categories):
+                updated_at = UPDATED_AT_ADAPTER.validate_python(a["updated_at"])
+                self.listing[a["id"]] = updated_at
+                is_updated = self.watermark.max_updated_at is None or updated_at > self.watermark.max_updated_at
+                if is_updated or a["id"] not in known_ids:
+                    yield _to_document(a)
+
+    def updated_watermark(self) -> ArticleWatermark:
+        """Watermark to persist for the next sync (call after changed_articles)."""
+        return ArticleWatermark(
+            max_updated_at=max(self.listing.values(), default=self.watermark.max_updated_at),
+            article_ids=sorted(self.listing),
+        )
+
+
+def _iter_article_pages(session: requests.Session) -> Iterator[list[dict]]:
+    """Geef de artikelen per pagina terug; na de eerste pagina worden de overige pagina's parallel opgehaald."""
+    first_page = _get_articles_page(session, page=1)
+    total_pages = first_page["meta"]["total_pages"]
+    nr_articles = len(first_page["articles"])
+    yield first_page["articles"]
+    del first_page
+
+    with ThreadPoolExecutor(max_workers=MAX_PARALLEL_REQUESTS) as executor:
+        futures = [executor.submit(_get_articles_page, session, page) for page in range(2, total_pages + 1)]
+        for future in as_completed(futures):
+            articles = future.result()["articles"]
+            nr_articles += len(articles)
+            yield articles
+
+    logger.info(f"Number of articles retrieved from API: {nr_articles}, total pages: {total_pages}")
+
+
+def _session() -> requests.Session:
+    """HTTP session with a connection pool for the parallel requests and retries on transient errors."""
+    retries = Retry(
+        total=MAX_RETRIES,
+        backoff_factor=1,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+    )
+    adapter = HTTPAdapter(pool_maxsize=MAX_PARALLEL_REQUESTS, max_retries=retries)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _get_articles_page(session: requests.Session, page: int) -> dict:
+    """Haal een pagina met artikelen op."""
     query_params = {
         "api_key": HELPJUICE_API_KEY,
         "limit": 1000,  # adjust as needed, this is the maximum value allowed by HelpJuice
-        "page": 1,
+        "page": page,
         "filter[is_published]": True,
     }
-    response = requests.get(HELPJUICE_API_URL + "/articles", params=query_params, timeout=3600)
+    response = session.get(HELPJUICE_API_URL + "/articles", params=query_params, timeout=REQUEST_TIMEOUT)
     response.raise_for_status()
-    articles = response.json()["articles"]
-
-    # retrieve total nr of pages and then get the articles on other pages:
-    total_pages = response.json()["meta"]["total_pages"]
-    for page in range(2, total_pages + 1):
-        query_params["page"] = page
-        response = requests.get(HELPJUICE_API_URL + "/articles", params=query_params, timeout=3600)
-        response.raise_for_status()
-        next_page_articles = response.json()["articles"]
-        articles.extend(next_page_articles)
+    return response.json()
 
-    logger.info(f"Number of articles retrieved from API: {len(articles)}, total pages: {total_pages}")
 
-    docs = []
+def _articles_in_categories(articles: list[dict], categories: list[int]) -> Iterator[dict]:
+    """Filter de artikelen in de categorieen van de klantenservice."""
     for a in articles:
         if "category" in a.keys():  # anders categorieloos, negeren
             if a["category"]["id"] in categories:
-                article_parsed = Article(**a)
-                pub_date = article_parsed.updated_at.strftime("%Y-%m-%d %H:%M")
-                doc = Document(
-                    page_content=article_parsed.body,
-                    metadata={
-                        "source": article_parsed.name,
-                        "date": pub_date,
-                        "url": article_parsed.url,
-                        "id": article_parsed.id,
-                    },
-                )
-                docs.append(doc)
-
-    return docs
-
-
-def _get_categories():
+                yield a
+
+
+def _to_document(article: dict) -> Document:
+    """Maak een Langchain document van een artikel."""
+    article_parsed = Article(**article)
+    pub_date = article_parsed.updated_at.strftime("%Y-%m-%d %H:%M")
+    return Document(
+        page_content=article_parsed.body,
+        metadata={
+            "source": article_parsed.name,
+            "date": pub_date,
+            "url": article_parsed.url,
+            "id": article_parsed.id,
+        },
+    )
+
+
+def _get_categories(session: requests.Session) -> list[int]:
     """Vind de categorieen waarbij 'Klantenservice (INTERN)' de hoofdmap/hoofdcategorie is (dus hoger in de
     hierarchy)."""
     query_params = {"api_key": HELPJUICE_API_KEY, "limit": 1000}
-    response = requests.get(HELPJUICE_API_URL + "/categories", params=query_params, timeout=3600)
+    response = session.get(HELPJUICE_API_URL + "/categories", params=query_params, timeout=REQUEST_TIMEOUT)
     response.raise_for_status()
     categories = response.json()["categories"]
     cat_ids = []
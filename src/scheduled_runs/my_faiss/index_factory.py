@@ -0,0 +1,72 @@
+"""Build the faiss index of the vectorstore from a faiss index factory spec instead of always an exact flat index.
+
+Examples of specs: "Flat" (exact search), "HNSW32" (graph, no training) and "IVF256,PQ48" (inverted lists with product
+quantization, trained on the embeddings). See https://github.com/facebookresearch/faiss/wiki/The-index-factory.
+"""
+import faiss
+import numpy as np
+from langchain.docstore.document import Document
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+
+from shared.chunk_store import set_search_parameters
+
+FLAT = "Flat"
+DEFAULT_EF_SEARCH = 64
+DEFAULT_NPROBE = 16
+
+
+def default_search_parameters(index_factory: str) -> dict[str, int]:
+    """Search time parameters for an index type, these are stored in the manifest and applied when loading."""
+    parameters = {}
+    if "HNSW" in index_factory:
+        parameters["efSearch"] = DEFAULT_EF_SEARCH
+    if "IVF" in index_factory:
+        parameters["nprobe"] = DEFAULT_NPROBE
+    return parameters
+
+
+def build_index(
+    vectors: np.ndarray, index_factory: str, search_parameters: dict[str, int] | None = None
+) -> faiss.Index:
+    """Create an (L2) index from a factory spec, train it on the vectors when the index type needs it and add them."""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    index = faiss.index_factory(vectors.shape[1], index_factory, faiss.METRIC_L2)
+    if not index.is_trained:
+        if len(vectors) < index_min_training_size(index_factory):
+            raise ValueError(
+                f"Index {index_factory} needs at least {index_min_training_size(index_factory)} vectors to train on, "
+                f"got {len(vectors)}."
+            )
+        index.train(vectors)
+    index.add(vectors)
+    set_search_parameters(index, search_parameters or default_search_parameters(index_factory))
+    return index
+
+
+def index_min_training_size(index_factory: str) -> int:
+    """Lower bound on the number of training vectors: one per IVF list and 256 per PQ codebook."""
+    minimum = 1
+    for part in index_factory.split(","):
+        if part.startswith("IVF"):
+            minimum = max(minimum, int(part[3:].split("_")[0]))
+        if part.startswith("PQ"):
+            minimum = max(minimum, 256)
+    return minimum
+
+
+def build_vectorstore(
+    docs: list[Document],
+    ids: list[str],
+    embeddings: Embeddings,
+    index_factory: str = FLAT,
+    search_parameters: dict[str, int] | None = None,
+) -> FAISS:
+    """Embed the chunks and create a LangChain FAISS vectorstore with an index of the given type."""
+    if index_factory == FLAT:
+        return FAISS.from_documents(docs, embeddings, ids=ids)
+    vectors = np.array(embeddings.embed_documents([doc.page_content for doc in docs]), dtype=np.float32)
+    index = build_index(vectors, index_factory, search_parameters)
+    docstore = InMemoryDocstore(dict(zip(ids, docs)))
+    return FAISS(embeddings, index, docstore, dict(enumerate(ids)))
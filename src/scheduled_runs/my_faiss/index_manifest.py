@@ -0,0 +1,68 @@
+import hashlib
+from pathlib import Path
+
+from langchain.docstore.document import Document
+from pydantic import BaseModel
+
+
+class ArticleEntry(BaseModel):
+    """Administration of a single Helpjuice article inside the FAISS index."""
+
+    date: str
+    content_hash: str
+    chunk_ids: list[str]
+
+
+class IndexManifest(BaseModel):
+    """Describes which articles (and which of their chunks) are stored in a FAISS index.
+
+    The manifest is uploaded next to the index files, so the next scheduled run can update the index incrementally
+    instead of re-embedding every article. It also records the type of faiss index (a faiss index factory spec) and its
+    search parameters, which the webapp applies when loading the index.
+    """
+
+    version: str | None = None
+    embeddings_model: str
+    chunk_size: int
+    chunk_overlap: int
+    index_factory: str = "Flat"
+    search_parameters: dict[str, int] = {}
+    articles: dict[str, ArticleEntry] = {}
+
+    @classmethod
+    def load(cls, path: str | Path) -> "IndexManifest":
+        """Read a manifest from a JSON file."""
+        with open(path, "r", encoding="utf-8") as f:
+            return cls.model_validate_json(f.read())
+
+    def save(self, path: str | Path) -> None:
+        """Write the manifest to a JSON file."""
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.model_dump_json(indent=2))
+
+    def is_compatible(self, other: "IndexManifest") -> bool:
+        """Chunks can only be reused when they were made and embedded with the same settings."""
+        return (
+            self.embeddings_model == other.embeddings_model
+            and self.chunk_size == other.chunk_size
+            and self.chunk_overlap == other.chunk_overlap
+        )
+
+    def settings(self) -> dict:
+        """Everything of the manifest but its articles: the chunk and embedding settings and the type of index."""
+        return self.model_dump(exclude={"version", "articles"})
+
+    def is_changed(self, doc: Document) -> bool:
+        """Whether the article is new or changed compared to the index."""
+        entry = self.articles.get(str(doc.metadata["id"]))
+        return entry is None or entry.date != doc.metadata["date"] or entry.content_hash != article_hash(doc)
+
+    def removed_article_ids(self, current_ids: set[str]) -> list[str]:
+        """Ids of the articles in the index that no longer exist in Helpjuice."""
+        return [article_id for article_id in self.articles if article_id not in current_ids]
+
+
+def article_hash(doc: Document) -> str:
+    """Hash of everything of an article that ends up in the index (title, url and body)."""
+    content = "\n".join([doc.metadata["source"], doc.metadata["url"], doc.page_content])
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
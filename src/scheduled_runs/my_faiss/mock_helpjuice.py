@@ -0,0 +1,115 @@
+"""Local mock of the Helpjuice API (/categories and paginated /articles) for developing and testing without an API key.
+
+Start it and point get_articles.py at it, for example:
+
+    python src/scheduled_runs/my_faiss/mock_helpjuice.py --articles 2500 --port 8010
+    HELPJUICE_API_URL=http://localhost:8010 HELPJUICE_API_KEY=mock python src/scheduled_runs/my_faiss/get_articles.py
+"""
+import argparse
+import datetime
+import json
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+KLANTENSERVICE_CATEGORY_ID = 89077
+MAX_LIMIT = 1000
+
+
+def fake_articles(nr_articles: int) -> list[dict]:
+    """Articles in the format of the Helpjuice API; every tenth article has no category."""
+    articles = []
+    for i in range(nr_articles):
+        body = f"Dit is artikel {i} van de kennisbank. " * 50
+        article = {
+            "id": 1000 + i,
+            "name": f"Artikel {i}",
+            "updated_at": (datetime.datetime(2024, 1, 1) + datetime.timedelta(hours=i)).isoformat() + "Z",
+            "published": True,
+            "answer": {"body_txt": body, "body": f"<p>{body}</p>"},
+            "url": f"https://helpjuice.example/artikel-{i}",
+        }
+        if i % 10 != 0:
+            article["category"] = {"id": KLANTENSERVICE_CATEGORY_ID + 1 + i % 3}
+        articles.append(article)
+    return articles
+
+
+def fake_categories() -> list[dict]:
+    """Three subcategories of 'Klantenservice (INTERN)' and one category of another team."""
+    categories = [
+        {"id": KLANTENSERVICE_CATEGORY_ID + 1 + i, "hierarchy": [{"id": KLANTENSERVICE_CATEGORY_ID}]} for i in range(3)
+    ]
+    categories.append({"id": 1, "hierarchy": []})
+    return categories
+
+
+class MockHelpjuiceServer(ThreadingHTTPServer):
+    """HTTP server with the data of the mock; latency (seconds) is added to every response."""
+
+    def __init__(self, port: int, articles: list[dict], latency: float = 0.0):
+        """Initialize the server on localhost."""
+        super().__init__(("localhost", port), MockHelpjuiceHandler)
+        self.articles = articles
+        self.categories = fake_categories()
+        self.latency = latency
+        self.requested_pages = []
+
+    @property
+    def url(self) -> str:
+        """Base url to use as HELPJUICE_API_URL."""
+        return f"http://localhost:{self.server_address[1]}"
+
+    def start_in_thread(self) -> threading.Thread:
+        """Serve in a daemon thread (call shutdown() to stop)."""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+class MockHelpjuiceHandler(BaseHTTPRequestHandler):
+    """Serves /categories and /articles like the Helpjuice API does."""
+
+    def do_GET(self):  # noqa: N802
+        """Handle a GET request."""
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        time.sleep(self.server.latency)
+
+        if url.path == "/categories":
+            self._send_json({"categories": self.server.categories})
+        elif url.path == "/articles":
+            limit = min(int(params.get("limit", 25)), MAX_LIMIT)
+            page = int(params.get("page", 1))
+            self.server.requested_pages.append(page)
+            start = (page - 1) * limit
+            end = start + limit
+            total_pages = max(1, math.ceil(len(self.server.articles) / limit))
+            self._send_json({"articles": self.server.articles[start:end], "meta": {"total_pages": total_pages}})
+        else:
+            self.send_error(404)
+
+    def _send_json(self, data: dict):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """Keep the output of the mock quiet."""
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--articles", type=int, default=2500)
+    parser.add_argument("--port", type=int, default=8010)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds of latency per request")
+    args = parser.parse_args()
+
+    server = MockHelpjuiceServer(args.port, fake_articles(args.articles), latency=args.latency)
+    print(f"Mock Helpjuice API running on {server.url}")
+    server.serve_forever()
@@ -1,10 +1,12 @@
 import argparse
 import copy
 import datetime
+import itertools
 import json
+import math
 import os
 from pathlib import Path
-from typing import List, Optional
+from typing import Iterable, Iterator, List, Optional
 
 import pypandoc
 from azure.identity import DefaultAzureCredential
@@ -14,11 +16,15 @@ from pymsteams import TeamsWebhookException, connectorcard
 from sharepoint_utility import SharePointUtility
 
 from scheduled_runs.runlogging import logger
+from shared.blob_download import download_blobs
+from shared.chat_records import full_conversations, reconstruct_conversations
 
 SHAREPOINT_URL = os.environ["SHAREPOINT_URL"]
 
 INPUT_FOLDER = "data/chats_json"
 OUTPUT_FOLDER = "data/chats_report/"
+# Split the report of a large day into multiple docx files of this many conversations (0: one file)
+MAX_CONVERSATIONS_PER_PART = int(os.environ.get("REPORT_MAX_CONVERSATIONS_PER_PART", 0))
 DEFAULT_PAYLOAD_TEMPLATE = {
     "type": "message",
     "attachments": [
@@ -48,9 +54,21 @@ def helper_container_client(credential, environment: str):
 class ProcessChats:
     """Process chat data and handle chat operations."""
 
-    def __init__(self, credential, date_to_process: str, environment: str = "dev"):
-        """Initialize ProcessChats with credentials and environment."""
+    def __init__(
+        self,
+        credential,
+        date_to_process: str,
+        environment: str = "dev",
+        in_memory: bool = False,
+        max_conversations_per_part: int = MAX_CONVERSATIONS_PER_PART,
+    ):
+        """Initialize ProcessChats.
+
+        With in_memory the chats are not stored in input_folder; with max_conversations_per_part a large day is split
+        into multiple docx files.
+        """
         self.credential = credential
+        self.in_memory = in_memory
         self.environment = environment
         self.date_to_process = date_to_process
         self.date_to_process_yyyymmdd = date_to_process.replace("-", "")
@@ -62,14 +80,16 @@ class ProcessChats:
         self.output_docx_file = f"{self.date_to_process_yyyymmdd}_output_all_conversations.docx"
         self.filepath_md_file = f"{self.output_folder}/{self.output_md_file}"
         self.filepath_docx_file = f"{self.output_folder}/{self.output_docx_file}"
+        self.max_conversations_per_part = max_conversations_per_part
+        self.filepath_md_files = [self.filepath_md_file]
+        self.filepath_docx_files = [self.filepath_docx_file]
 
         Path(self.input_folder).mkdir(parents=True, exist_ok=True)
         Path(self.output_folder).mkdir(parents=True, exist_ok=True)
 
     def main(self) -> dict:
         """Main function to process the chats."""
-        self.retrieve_chats()
-        json_files = self.load_json_files()
+        json_files = reconstruct_conversations(self.retrieve_chats())
         info = {}
         full_conversations = self.find_full_conversations(json_files)
         full_conversations, nr_questions, nr_sessions = self.edit_session_id_and_count(full_conversations)
@@ -77,29 +97,45 @@ class ProcessChats:
         info["number_sessions"] = nr_sessions
         info["number_of_conversations"] = len(full_conversations)
         conversations_md = self.format_to_markdown(full_conversations)
-        self.merge_markdown_files(conversations_md)
+        self.merge_markdown_files(conversations_md, len(full_conversations))
         self.convert_to_docx()
         info["date_to_process"] = self.date_to_process
+        nr_parts = len(self.filepath_docx_files)
+        info["parts_text"] = f" Het rapport bestaat uit {nr_parts} delen." if nr_parts > 1 else ""
         return info
 
-    def retrieve_chats(self):
-        """Retrieve chats from datalake."""
+    def retrieve_chats(self) -> list[dict]:
+        """Retrieve the chats of the day from datalake.
+
+        Only the blobs of the day are listed (their names start with the session_uuid, which starts with the date) and
+        they are downloaded concurrently. Unless in_memory, they are also stored in input_folder.
+
+        Returns:
+            list: The chat records, ordered by the time in their file names.
+        """
         aux = self.environment if self.environment != "dev" else "tst"  # for dev we use chats from tst slot app
         base = f"klantenservice-chatbot-medewerker/{aux}/chat/"
         container_client = helper_container_client(self.credential, self.environment)
-        filenames = [
-            name for name in container_client.list_blob_names() if f"{base}{self.date_to_process_yyyymmdd}" in name
-        ]
-        for filename in filenames:
-            with open(f"{self.input_folder}/{filename.replace(base, '')}", "wb") as f:
-                blob_data = container_client.download_blob(f"{filename}").readall()
-                f.write(blob_data)
+        blob_names = list(container_client.list_blob_names(name_starts_with=f"{base}{self.date_to_process_yyyymmdd}"))
+        logger.info(f"Number of chat records on {self.date_to_process}: {len(blob_names)}")
+        records = {}
+        for blob_name, blob_data in download_blobs(container_client, blob_names):
+            filename = blob_name.replace(base, "")
+            if not self.in_memory:
+                with open(f"{self.input_folder}/{filename}", "wb") as f:
+                    f.write(blob_data)
+            records[filename] = json.loads(blob_data)
+        # sort filenames on timestamp last question:
+        return [records[filename] for filename in sorted(records, key=lambda x: x.split("_")[2])]
 
     def load_json_files(self) -> list[dict]:
         """Load JSON files.
 
+        Turn records (one per question) are merged into snapshots of their conversation, the format of the older chat
+        records (see shared.chat_records).
+
         Returns:
-            list: A list of dictionaries, each representing the contents of a JSON file.
+            list: A list of dictionaries, each representing a snapshot of a conversation.
         """
         json_files = []
         filenames = os.listdir(self.input_folder)
@@ -109,32 +145,15 @@ class ProcessChats:
             if filename.endswith(".json"):
                 with open(os.path.join(self.input_folder, filename), "r") as file:
                     json_files.append(json.load(file))
-        return json_files
+        return reconstruct_conversations(json_files)
 
     @staticmethod
     def find_full_conversations(json_files: list[dict]) -> list[dict]:
-        """Na elk bericht wordt het gesprek tot dan toe geupload naar het datalake.
+        """Na elk bericht werd het gesprek tot dan toe geupload naar het datalake.
 
-        Vind de volledige gesprekken en filter de onvolledige.
+        Vind de volledige gesprekken en filter de onvolledige (zie shared.chat_records.full_conversations).
         """
-
-        conversations_in_list = []
-        for data in json_files:
-            messages = [message["content"] for message in data["conversation"]]
-            messages_conc = " ".join(messages)
-            conversations_in_list.append(messages_conc)
-
-        to_delete = []
-        for i in range(len(conversations_in_list)):
-            for j in range(i + 1, len(conversations_in_list)):
-                if conversations_in_list[i] in conversations_in_list[j]:
-                    to_delete.append(i)
-                elif conversations_in_list[j] in conversations_in_list[i]:
-                    to_delete.append(j)
-
-        json_files_reduced = [json_files[i] for i in range(len(json_files)) if i not in to_delete]
-
-        return json_files_reduced
+        return full_conversations(json_files)
 
     def edit_session_id_and_count(self, json_files: list[dict]) -> tuple[list[dict], int, int]:
         """Vervang de session id met een integer en tel het aantal gestelde vragen en het aantal sessies.
@@ -158,39 +177,55 @@ class ProcessChats:
 
         return json_files, len(all_questions), len(unique_sessions)
 
-    def format_to_markdown(self, json_files: list[dict]) -> list[str]:
-        """Convert conversations (as json files) to Markdown format as a string, put them in a list and pass it to the
-        next function."""
-        md_strings = []
-        for j, data in enumerate(json_files):
+    def format_to_markdown(self, json_files: Iterable[dict]) -> Iterator[str]:
+        """Zet de gesprekken (als json files) één voor één om naar Markdown.
+
+        Het is een generator, zodat het rapport per gesprek weggeschreven kan worden.
+        """
+        for data in json_files:
             session_uuid = data["session_uuid"]
             timestamp = datetime.datetime.strptime(data["timestamp_last_chat"], "%Y-%m-%d %H:%M:%S")
             conversation = data["conversation"]
 
-            conversation_md = f"## Sessie {session_uuid}, laatste vraag: {timestamp.strftime('%Y-%m-%d %H:%M:%S')}\n\n"
+            lines = [f"## Sessie {session_uuid}, laatste vraag: {timestamp.strftime('%Y-%m-%d %H:%M:%S')}\n\n"]
             for message in conversation:
-                conversation_md += f"**{message['role'].capitalize()}**: {message['content']}\n\n"
+                lines.append(f"**{message['role'].capitalize()}**: {message['content']}\n\n")
                 source_titles = message.get("source_titles", [])
                 urls = message.get("urls", [])
                 for i in range(len(source_titles)):
                     hyperlink = f"[{source_titles[i]}]({urls[i]})"
-                    conversation_md += f"{i + 1}. {hyperlink}\n"
-                conversation_md += "\n"
+                    lines.append(f"{i + 1}. {hyperlink}\n")
+                lines.append("\n")
+
+            yield "".join(lines)
 
-            md_strings.append(conversation_md)
-        return md_strings
+    def merge_markdown_files(self, conversations_md: Iterable[str], nr_conversations: int):
+        """Schrijf de gesprekken één voor één weg naar het Markdown bestand.
 
-    def merge_markdown_files(self, list_of_markdown_strings: list[str]):
-        """Merge all the Markdown files in the specified folder."""
-        merged_md = ""
-        for conversation_md in list_of_markdown_strings:
-            merged_md += conversation_md + "\n\n"
-        with open(self.filepath_md_file, "w") as file:
-            file.write(merged_md)
+        Als max_conversations_per_part gezet is en er meer gesprekken zijn, worden het meerdere delen
+        (..._deel1.md, ..._deel2.md, ...) die elk apart naar docx omgezet worden.
+        """
+        nr_parts = 1
+        if self.max_conversations_per_part and nr_conversations > self.max_conversations_per_part:
+            nr_parts = math.ceil(nr_conversations / self.max_conversations_per_part)
+            self.filepath_md_files = [
+                self.filepath_md_file.replace(".md", f"_deel{part}.md") for part in range(1, nr_parts + 1)
+            ]
+            self.filepath_docx_files = [
+                self.filepath_docx_file.replace(".docx", f"_deel{part}.docx") for part in range(1, nr_parts + 1)
+            ]
+
+        conversations_md = iter(conversations_md)
+        for part, filepath_md_file in enumerate(self.filepath_md_files):
+            nr_in_part = self.max_conversations_per_part if part < nr_parts - 1 else None
+            with open(filepath_md_file, "w") as file:
+                for conversation_md in itertools.islice(conversations_md, nr_in_part):
+                    file.write(conversation_md + "\n\n")
 
     def convert_to_docx(self):
-        """Convert the Markdown file to a DOCX file."""
-        pypandoc.convert_file(self.filepath_md_file, "docx", outputfile=self.filepath_docx_file)
+        """Convert the Markdown file(s) to DOCX file(s)."""
+        for filepath_md_file, filepath_docx_file in zip(self.filepath_md_files, self.filepath_docx_files):
+            pypandoc.convert_file(filepath_md_file, "docx", outputfile=filepath_docx_file)
 
 
 class MessageDTO(BaseModel):
@@ -273,6 +308,7 @@ if __name__ == "__main__":
         default=datetime.date.today().strftime("%Y-%m-%d"),
         type=str,
     )
+    parser.add_argument("--in-memory", action="store_true", help="Don't store the chats in data/chats_json")
     args = parser.parse_args()
 
     if os.environ["ENVIRONMENT"] == "prd":
@@ -294,7 +330,7 @@ if __name__ == "__main__":
     # Process chats
     credential = DefaultAzureCredential()
     logger.info("Start processing chats")
-    process_chats = ProcessChats(credential, args.date_to_process, os.environ["ENVIRONMENT"])
+    process_chats = ProcessChats(credential, args.date_to_process, os.environ["ENVIRONMENT"], args.in_memory)
     info = process_chats.main()
 
     # Write to Sharepoint
@@ -314,12 +350,13 @@ if __name__ == "__main__":
 
     if DATA_SCIENCE_OPS_DRIVE_ID is not None:
 
-        # Upload a file
-        response = sp.upload_file(
-            drive_id=DATA_SCIENCE_OPS_DRIVE_ID,
-            folder_path=sharepoint_folder_path,
-            local_file_path=process_chats.filepath_docx_file,
-        )
+        # Upload the file(s), the message links to the first part
+        for filepath_docx_file in reversed(process_chats.filepath_docx_files):
+            response = sp.upload_file(
+                drive_id=DATA_SCIENCE_OPS_DRIVE_ID,
+                folder_path=sharepoint_folder_path,
+                local_file_path=filepath_docx_file,
+            )
 
         url_conversations = response.get("webUrl")
 
@@ -327,7 +364,7 @@ if __name__ == "__main__":
     logger.info("Start writing to Teams")
 
     message = MessageDTO(
-        text=f"""Aantal vragen gesteld: {info['number_questions']}. Aantal gesprekken: {info['number_of_conversations']}. Aantal sessies: {info['number_sessions']}.""",  # noqa: E501
+        text=f"""Aantal vragen gesteld: {info['number_questions']}. Aantal gesprekken: {info['number_of_conversations']}. Aantal sessies: {info['number_sessions']}.{info['parts_text']}""",  # noqa: E501
         title=f"Rapportage gebruik Ally op {info['date_to_process']}",
         mention_users=mention_users,
         link_title="Bekijk de gestelde vragen en de antwoorden die ik heb gegeven",
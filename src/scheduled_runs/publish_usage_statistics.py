@@ -0,0 +1,69 @@
+"""Publish the daily aggregates of the usage statistics to the datalake, for the Statistieken page of the webapp.
+
+Runs next to process_chats.py in the reporting container. The production chats since the previous run are ingested
+(see shared.usage_statistics), aggregated per day and merged into the table on the datalake (see
+shared.usage_aggregates), so the page only has to read that small table.
+"""
+import argparse
+import os
+
+import pandas as pd
+from azure.identity import DefaultAzureCredential
+from azure.storage.blob import ContainerClient
+
+from scheduled_runs.runlogging import logger
+from shared.usage_aggregates import (
+    AGGREGATES_BLOB,
+    COLUMNS,
+    daily_aggregates,
+    from_parquet_bytes,
+    merge_aggregates,
+    to_parquet_bytes,
+)
+from shared.usage_statistics import UsageWatermark, ingest
+
+NAME_FOLDER = "klantenservice-chatbot-medewerker"
+
+
+def helper_container_client(credential, environment: str) -> ContainerClient:
+    """Initialize container client (datalake, container ds-files)."""
+    name_storage = os.environ["DATALAKE_NAME_PRD"] if environment == "prd" else os.environ["DATALAKE_NAME_DEV"]
+    return ContainerClient(
+        account_url=f"https://{name_storage}.blob.core.windows.net", container_name="ds-files", credential=credential
+    )
+
+
+def publish_usage_statistics(credential, environment: str) -> dict:
+    """Add the production chats since the previous run to the daily aggregates of the environment."""
+    chats_client = helper_container_client(credential, "prd")
+    aux = environment if environment != "dev" else "tst"  # like the chats, dev publishes for the tst slot app
+    blob_client = helper_container_client(credential, environment).get_blob_client(
+        f"{NAME_FOLDER}/{aux}/{AGGREGATES_BLOB}"
+    )
+    if blob_client.exists():
+        aggregates, watermark = from_parquet_bytes(blob_client.download_blob().readall())
+        logger.info(f"Daily usage aggregates found up to {watermark.last_date}.")
+    else:
+        aggregates, watermark = pd.DataFrame(columns=COLUMNS), UsageWatermark()
+        logger.info("No daily usage aggregates found, aggregating all chats.")
+
+    rows, new_watermark = ingest(chats_client, watermark)
+    if not rows.empty:
+        aggregates = merge_aggregates(aggregates, daily_aggregates(rows))
+    # Also on a day without chats, so the next run doesn't list that day again
+    if new_watermark != watermark:
+        blob_client.upload_blob(to_parquet_bytes(aggregates, new_watermark), overwrite=True)
+    logger.info(f"Published {len(rows)} new messages, the daily usage aggregates have {len(aggregates)} days.")
+    return {"new_messages": len(rows), "days": len(aggregates), "last_date": new_watermark.last_date}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--environment", default=os.environ["ENVIRONMENT"])
+    args = parser.parse_args()
+
+    try:
+        publish_usage_statistics(DefaultAzureCredential(), args.environment)
+    except Exception:
+        logger.exception("Publishing the daily usage aggregates failed.")
+        raise
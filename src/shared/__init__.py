@@ -0,0 +1 @@
+"""Shared package."""
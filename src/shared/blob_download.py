@@ -0,0 +1,67 @@
+"""Concurrent download of many small blobs (chat records) from the datalake.
+
+At most max_workers downloads run at the same time and at most twice as many results are held in memory, so the
+blobs can be processed as a stream. A failed download is retried with exponential backoff; when it keeps failing, the
+exception is raised, or yielded in place of the content with return_exceptions, so the other blobs can still be
+processed.
+"""
+import logging
+import time
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from azure.core.exceptions import ResourceNotFoundError
+from azure.storage.blob import ContainerClient
+
+MAX_PARALLEL_DOWNLOADS = 16
+MAX_RETRIES = 3
+
+
+def download_blob_with_retries(
+    container_client: ContainerClient, blob_name: str, max_retries: int = MAX_RETRIES
+) -> bytes:
+    """Content of a blob, retrying transient errors (a missing blob is not retried)."""
+    for attempt in range(max_retries + 1):
+        try:
+            return container_client.download_blob(blob_name).readall()
+        except ResourceNotFoundError:
+            raise
+        except Exception as e:
+            if attempt == max_retries:
+                raise
+            logging.getLogger("KS-FAQ").warning(f"Downloading {blob_name} failed (attempt {attempt + 1}): {repr(e)}")
+            time.sleep(2**attempt)
+
+
+def download_blobs(
+    container_client: ContainerClient,
+    blob_names: Iterable[str],
+    max_workers: int = MAX_PARALLEL_DOWNLOADS,
+    max_retries: int = MAX_RETRIES,
+    return_exceptions: bool = False,
+) -> Iterator[tuple[str, bytes | Exception]]:
+    """Download blobs concurrently; yields (blob name, content) in the order of blob_names.
+
+    With return_exceptions, a blob that can't be downloaded yields its exception instead of raising it.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="download") as executor:
+        in_flight = deque()
+        for blob_name in blob_names:
+            in_flight.append(
+                (blob_name, executor.submit(download_blob_with_retries, container_client, blob_name, max_retries))
+            )
+            if len(in_flight) >= 2 * max_workers:
+                name, future = in_flight.popleft()
+                yield name, _result(future, return_exceptions)
+        while in_flight:
+            name, future = in_flight.popleft()
+            yield name, _result(future, return_exceptions)
+
+
+def _result(future: Future, return_exceptions: bool) -> bytes | Exception:
+    """Result of a download, or its exception when return_exceptions."""
+    exception = future.exception()
+    if exception is not None and return_exceptions:
+        return exception
+    return future.result()
@@ -0,0 +1,79 @@
+"""Chat records on the datalake (folder chat/).
+
+The webapp used to upload a snapshot of the whole conversation after every answer, named
+{session_uuid}_{HHMMSS}.json with the messages under "conversation". Now it uploads one record per turn with only
+the new messages under "messages", named {session_uuid}_{HHMMSS}_{conversation_nr}-{turn}.json. Both kinds of
+records carry session_uuid, timestamp_last_chat and hashed_user, so a record still counts as one question. The
+conversations are rebuilt from the turn records with reconstruct_conversations, and full_conversations drops the
+snapshots of a conversation that were overtaken by a later snapshot.
+"""
+import hashlib
+from collections.abc import Iterable
+
+TURN_FIELDS = ("conversation_nr", "turn", "messages")
+
+
+def turn_blob_name(record: dict) -> str:
+    """Name (without folder) of the blob of a turn record."""
+    timestamp_no_date = record["timestamp_last_chat"][11:].replace(":", "")
+    return f"{record['session_uuid']}_{timestamp_no_date}_{record['conversation_nr']}-{record['turn']}.json"
+
+
+def is_turn_record(record: dict) -> bool:
+    """Whether a record is a turn record (and not a snapshot of the whole conversation)."""
+    return "messages" in record and "conversation" not in record
+
+
+def reconstruct_conversations(records: Iterable[dict]) -> list[dict]:
+    """Snapshots of the conversations, in the format of the old records, ordered by timestamp_last_chat.
+
+    Snapshots are passed on as they are. Turn records are merged per conversation (session_uuid and conversation_nr)
+    into a single snapshot of the whole conversation, with the timestamp and faiss version of the last turn.
+    """
+    snapshots = []
+    turns_per_conversation: dict[tuple[str, int], list[dict]] = {}
+    for record in records:
+        if is_turn_record(record):
+            turns_per_conversation.setdefault((record["session_uuid"], record["conversation_nr"]), []).append(record)
+        else:
+            snapshots.append(record)
+
+    for turns in turns_per_conversation.values():
+        turns.sort(key=lambda turn: turn["turn"])
+        last_turn = turns[-1]
+        snapshot = {key: value for key, value in last_turn.items() if key not in TURN_FIELDS}
+        snapshot["conversation"] = [message for turn in turns for message in turn["messages"]]
+        snapshots.append(snapshot)
+
+    return sorted(snapshots, key=lambda snapshot: snapshot["timestamp_last_chat"])
+
+
+def _message_digests(snapshot: dict) -> list[bytes]:
+    """Digest of every prefix of the messages of a snapshot (the last one is that of all messages)."""
+    digests = []
+    digest = b""
+    for message in snapshot["conversation"]:
+        digest = hashlib.blake2b(digest + message["content"].encode("utf-8"), digest_size=16).digest()
+        digests.append(digest)
+    return digests
+
+
+def full_conversations(snapshots: list[dict]) -> list[dict]:
+    """The snapshots of complete conversations, in their original order.
+
+    A snapshot is dropped when its messages are a proper prefix of those of another snapshot of the same session, or
+    when a later snapshot of the session has the same messages. Prefixes are compared by a digest of the message
+    contents, so this takes time linear in the total number of messages.
+    """
+    overtaken = set()  # (session_uuid, digest) of every proper prefix of a snapshot
+    keys = []
+    for snapshot in snapshots:
+        digests = _message_digests(snapshot)
+        overtaken.update((snapshot["session_uuid"], digest) for digest in digests[:-1])
+        keys.append((snapshot["session_uuid"], digests[-1] if digests else b""))
+    last_index = {key: i for i, key in enumerate(keys)}
+    return [
+        snapshot
+        for i, (snapshot, key) in enumerate(zip(snapshots, keys))
+        if key not in overtaken and last_index[key] == i
+    ]
@@ -0,0 +1,156 @@
+"""Compact, memory-mappable store for the chunks (text and metadata) of a faiss index.
+
+It replaces the pickled docstore (index.pkl) that LangChain writes next to the index, which is slow and memory-hungry
+to load and unsafe to unpickle. The file layout is:
+
+    b"ALLYDOCS" | uint64 number of chunks n | uint64 offsets[n + 1] | UTF-8 JSON records
+
+(integers little endian, offsets relative to the start of the records). Record i belongs to vector i of the faiss index
+and looks like {"id": chunk_id, "page_content": ..., "metadata": {...}}. Opening the store only maps the file, a record
+is decoded when a search hits it, so startup does not depend on the size of the index and processes on the same host
+share the pages.
+"""
+import json
+import mmap
+import struct
+from collections.abc import Iterator, Mapping
+from pathlib import Path
+
+import faiss
+import numpy as np
+from langchain.docstore.document import Document
+from langchain_community.docstore.base import Docstore
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+
+MAGIC = b"ALLYDOCS"
+HEADER_SIZE = len(MAGIC) + 8
+FAISS_MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+def write_chunk_store(faiss_db: FAISS, path: str | Path) -> None:
+    """Write the docstore of a LangChain FAISS vectorstore as a chunk store, in the order of the faiss index."""
+    records = []
+    for position in range(len(faiss_db.index_to_docstore_id)):
+        chunk_id = faiss_db.index_to_docstore_id[position]
+        doc = faiss_db.docstore.search(chunk_id)
+        record = {"id": chunk_id, "page_content": doc.page_content, "metadata": doc.metadata}
+        records.append(json.dumps(record, ensure_ascii=False).encode("utf-8"))
+
+    offsets = np.zeros(len(records) + 1, dtype="<u8")
+    offsets[1:] = np.cumsum([len(record) for record in records], dtype="<u8")
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(records)))
+        f.write(offsets.tobytes())
+        for record in records:
+            f.write(record)
+
+
+class MmapChunkStore(Docstore):
+    """Read-only docstore on top of a memory-mapped chunk store file.
+
+    The docstore ids are the positions in the faiss index (as strings), see index_to_docstore_id.
+    """
+
+    def __init__(self, path: str | Path):
+        """Map the file into memory."""
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a chunk store.")
+        (self.nr_chunks,) = struct.unpack_from("<Q", self.mm, len(MAGIC))
+        self.offsets = np.frombuffer(self.mm, dtype="<u8", count=self.nr_chunks + 1, offset=HEADER_SIZE)
+        self.records_start = HEADER_SIZE + 8 * (self.nr_chunks + 1)
+
+    def __len__(self) -> int:
+        """Number of chunks."""
+        return self.nr_chunks
+
+    def record(self, position: int) -> dict:
+        """Decode the record of the chunk at a position in the faiss index."""
+        start = self.records_start + int(self.offsets[position])
+        end = self.records_start + int(self.offsets[position + 1])
+        return json.loads(self.mm[start:end])
+
+    def records(self) -> Iterator[dict]:
+        """All records, in the order of the faiss index."""
+        for position in range(self.nr_chunks):
+            yield self.record(position)
+
+    def search(self, search: str) -> str | Document:
+        """Document of the chunk with this docstore id (its position in the faiss index)."""
+        position = int(search)
+        if not 0 <= position < self.nr_chunks:
+            return f"ID {search} not found."
+        record = self.record(position)
+        return Document(page_content=record["page_content"], metadata=record["metadata"])
+
+    @property
+    def index_to_docstore_id(self) -> Mapping[int, str]:
+        """Mapping from position in the faiss index to docstore id, without materializing a dict."""
+        return _PositionIds(self.nr_chunks)
+
+
+class _PositionIds(Mapping):
+    """Maps position i to docstore id str(i)."""
+
+    def __init__(self, length: int):
+        self.length = length
+
+    def __getitem__(self, position: int) -> str:
+        if not 0 <= position < self.length:
+            raise KeyError(position)
+        return str(position)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(self.length))
+
+    def __len__(self) -> int:
+        return self.length
+
+
+def set_search_parameters(index: faiss.Index, search_parameters: dict[str, int]) -> None:
+    """Apply search time parameters (e.g. efSearch for HNSW, nprobe for IVF) to an index."""
+    parameter_space = faiss.ParameterSpace()
+    for name, value in search_parameters.items():
+        parameter_space.set_index_parameter(index, name, value)
+
+
+def load_faiss(
+    folder_path: str,
+    index_name: str,
+    embeddings: Embeddings,
+    mmap_index: bool = True,
+    search_parameters: dict[str, int] | None = None,
+) -> FAISS:
+    """Load a faiss index with its chunk store (index_name.docs) read-only; chunks are only decoded for search hits.
+
+    With mmap_index the index itself is memory-mapped as well instead of read into memory. The search parameters of
+    approximate indexes (HNSW, IVF) are recorded in the manifest of the index and passed here.
+    """
+    index_path = str(Path(folder_path) / f"{index_name}.faiss")
+    index = faiss.read_index(index_path, FAISS_MMAP_FLAGS) if mmap_index else faiss.read_index(index_path)
+    set_search_parameters(index, search_parameters or {})
+    docstore = MmapChunkStore(Path(folder_path) / f"{index_name}.docs")
+    return FAISS(embeddings, index, docstore, docstore.index_to_docstore_id)
+
+
+def load_faiss_in_memory(folder_path: str, index_name: str, embeddings: Embeddings) -> FAISS:
+    """Load a faiss index with its chunk store into an in-memory docstore, so chunks can be added and deleted."""
+    index = faiss.read_index(str(Path(folder_path) / f"{index_name}.faiss"))
+    chunk_store = MmapChunkStore(Path(folder_path) / f"{index_name}.docs")
+    docs = {}
+    index_to_docstore_id = {}
+    for position, record in enumerate(chunk_store.records()):
+        docs[record["id"]] = Document(page_content=record["page_content"], metadata=record["metadata"])
+        index_to_docstore_id[position] = record["id"]
+    return FAISS(embeddings, index, InMemoryDocstore(docs), index_to_docstore_id)
+
+
+def save_faiss(faiss_db: FAISS, folder_path: str, index_name: str = "index") -> None:
+    """Save the faiss index and its chunk store (instead of the pickled docstore of FAISS.save_local)."""
+    Path(folder_path).mkdir(parents=True, exist_ok=True)
+    faiss.write_index(faiss_db.index, str(Path(folder_path) / f"{index_name}.faiss"))
+    write_chunk_store(faiss_db, Path(folder_path) / f"{index_name}.docs")
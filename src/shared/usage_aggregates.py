@@ -0,0 +1,94 @@
+"""Daily aggregates of the usage statistics, as published by scheduled_runs/publish_usage_statistics.py.
+
+One row per date (of timestamp_last_chat) with the number of messages, unique users and sessions. The users and sessions
+of a day are also kept as distinct-count sketches of at most 4 kB (see shared.distinct_sketch), so days can be merged
+(when chats of a day come in over several runs) and the unique users over any date range can be counted without the raw
+rows. The table is a single parquet file that also holds the watermark of the ingestion (see shared.usage_statistics)
+in its metadata, so the aggregates and the watermark are always updated together.
+
+Each run rewrites the whole file instead of appending a partition per day. That is safe because it grows by one row per
+day of at most about 8 kB (two sketches of at most 4 kB and three counts), so at most 3 MB per year: less to rewrite
+than the raw rows of a single busy day, and the statistics page reads it in one download.
+"""
+import hashlib
+import io
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from shared.distinct_sketch import DistinctSketch, merge_sketches
+from shared.usage_statistics import UsageWatermark
+
+AGGREGATES_BLOB = "usage-statistics/daily_usage.parquet"  # relative to klantenservice-chatbot-medewerker/{env}
+COLUMNS = ["date", "messages", "users", "sessions", "user_ids", "session_ids"]  # *_ids: DistinctSketch bytes
+WATERMARK_METADATA_KEY = b"usage_watermark"
+
+
+def hash_ids(values: pd.Series) -> np.ndarray:
+    """Sorted unique 64-bit hashes of the (non-empty) values."""
+    hashes = {
+        int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "little")
+        for value in values.dropna()
+    }
+    return np.array(sorted(hashes), dtype=np.uint64)
+
+
+def daily_aggregates(rows: pd.DataFrame) -> pd.DataFrame:
+    """Aggregates per date of usage-statistics rows (see shared.usage_statistics.FIELDS)."""
+    aggregates = []
+    for day, rows_day in rows.groupby(rows["timestamp_last_chat"].str[:10]):
+        user_ids = DistinctSketch.from_hashes(hash_ids(rows_day["hashed_user"]))
+        session_ids = DistinctSketch.from_hashes(hash_ids(rows_day["session_uuid"]))
+        aggregates.append(
+            {
+                "date": day,
+                "messages": len(rows_day),
+                "users": user_ids.count(),
+                "sessions": session_ids.count(),
+                "user_ids": user_ids.to_bytes(),
+                "session_ids": session_ids.to_bytes(),
+            }
+        )
+    return pd.DataFrame(aggregates, columns=COLUMNS)
+
+
+def merge_aggregates(old: pd.DataFrame, new: pd.DataFrame) -> pd.DataFrame:
+    """Aggregates of old and new together; the messages of a date add up and its users and sessions are merged."""
+    merged = []
+    for day, aggregates_day in pd.concat([old, new], ignore_index=True).groupby("date"):
+        user_ids = union_ids(aggregates_day["user_ids"])
+        session_ids = union_ids(aggregates_day["session_ids"])
+        merged.append(
+            {
+                "date": day,
+                "messages": int(aggregates_day["messages"].sum()),
+                "users": user_ids.count(),
+                "sessions": session_ids.count(),
+                "user_ids": user_ids.to_bytes(),
+                "session_ids": session_ids.to_bytes(),
+            }
+        )
+    return pd.DataFrame(merged, columns=COLUMNS)
+
+
+def union_ids(ids_per_day: pd.Series) -> DistinctSketch:
+    """Sketch of the users or sessions of all days together; its count() is the number of unique ones."""
+    return merge_sketches([DistinctSketch.from_bytes(ids) for ids in ids_per_day])
+
+
+def to_parquet_bytes(aggregates: pd.DataFrame, watermark: UsageWatermark) -> bytes:
+    """The aggregates as a parquet file, with the watermark in its metadata."""
+    table = pa.Table.from_pandas(aggregates[COLUMNS], preserve_index=False)
+    metadata = {**(table.schema.metadata or {}), WATERMARK_METADATA_KEY: watermark.model_dump_json().encode("utf-8")}
+    buffer = io.BytesIO()
+    pq.write_table(table.replace_schema_metadata(metadata), buffer)
+    return buffer.getvalue()
+
+
+def from_parquet_bytes(data: bytes) -> tuple[pd.DataFrame, UsageWatermark]:
+    """The aggregates and the watermark of a parquet file written by to_parquet_bytes."""
+    table = pq.read_table(io.BytesIO(data))
+    watermark = UsageWatermark.model_validate_json((table.schema.metadata or {})[WATERMARK_METADATA_KEY])
+    return table.to_pandas(), watermark
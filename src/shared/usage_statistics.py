@@ -0,0 +1,153 @@
+"""Incremental ingestion of the usage statistics: one row per chat record on the datalake.
+
+A run only lists the date prefixes of the chat blobs since the previous run (the names start with the session_uuid,
+which starts with the date the session started) and downloads the blobs it has not ingested yet, up to yesterday.
+Sessions can go on after midnight under the date they started, so the blob names of the last LOOKBACK_DAYS date
+prefixes are kept in the watermark and those prefixes are listed again. The blobs are downloaded concurrently and only
+the FIELDS are extracted from them, into Arrow record batches. The rows are aggregated per day by
+scheduled_runs/publish_usage_statistics.py, which stores the watermark with the aggregates (see
+shared.usage_aggregates).
+"""
+import json
+import logging
+from datetime import date, datetime, timedelta
+from typing import Iterator
+
+import pandas as pd
+import pyarrow as pa
+from azure.storage.blob import ContainerClient
+from pydantic import BaseModel
+
+from shared.blob_download import download_blobs
+
+CHAT_FOLDER = "klantenservice-chatbot-medewerker/prd/chat/"
+LOOKBACK_DAYS = 2
+FIELDS = ["environment", "session_uuid", "timestamp_last_chat", "hashed_user"]
+KEY = ["session_uuid", "timestamp_last_chat"]
+SCHEMA = pa.schema([(field, pa.string()) for field in FIELDS])
+BATCH_ROWS = 10_000
+PROGRESS_EVERY = 100
+
+_FIELD_MARKERS = {field: f'"{field}": "'.encode("utf-8") for field in FIELDS}
+
+
+class UsageWatermark(BaseModel):
+    """State of the ingestion: the last date prefix that was listed and the blobs ingested in the lookback window."""
+
+    last_date: str | None = None  # YYYYMMDD
+    blob_names: dict[str, list[str]] = {}  # date prefix (YYYYMMDD) -> ingested blob names
+
+    def updated(
+        self, ingested_blob_names: list[str], today: date, failed_blob_names: list[str] | None = None
+    ) -> "UsageWatermark":
+        """Watermark after ingesting the blobs (everything before today was listed).
+
+        The last date is held back so that the next run lists the date prefixes of the failed blobs again.
+        """
+        last_day = today - timedelta(days=1)
+        for blob_name in failed_blob_names or []:
+            failed_day = datetime.strptime(blob_date_prefix(blob_name), "%Y%m%d").date()
+            last_day = min(last_day, failed_day + timedelta(days=LOOKBACK_DAYS))
+        first_kept = (last_day - timedelta(days=LOOKBACK_DAYS)).strftime("%Y%m%d")
+        blob_names = {prefix: list(names) for prefix, names in self.blob_names.items() if prefix >= first_kept}
+        for blob_name in ingested_blob_names:
+            prefix = blob_date_prefix(blob_name)
+            if prefix >= first_kept:
+                blob_names.setdefault(prefix, []).append(blob_name)
+        return UsageWatermark(last_date=last_day.strftime("%Y%m%d"), blob_names=blob_names)
+
+
+def blob_date_prefix(blob_name: str) -> str:
+    """Date (YYYYMMDD) the session of a chat blob started: the start of its name, e.g. 20251113."""
+    return blob_name.split("/")[-1][:8]
+
+
+def list_new_blobs(container_client: ContainerClient, watermark: UsageWatermark, today: date) -> list[str]:
+    """Names of the chat blobs of sessions started before today that are not ingested yet."""
+    today_prefix = today.strftime("%Y%m%d")
+    if watermark.last_date is None:
+        names = container_client.list_blob_names(name_starts_with=CHAT_FOLDER)
+        return [name for name in names if name.endswith(".json") and blob_date_prefix(name) < today_prefix]
+
+    new_blob_names = []
+    day = datetime.strptime(watermark.last_date, "%Y%m%d").date() - timedelta(days=LOOKBACK_DAYS)
+    while day < today:
+        prefix = day.strftime("%Y%m%d")
+        ingested = set(watermark.blob_names.get(prefix, []))
+        for name in container_client.list_blob_names(name_starts_with=f"{CHAT_FOLDER}{prefix}"):
+            if name.endswith(".json") and name not in ingested:
+                new_blob_names.append(name)
+        day += timedelta(days=1)
+    return new_blob_names
+
+
+def extract_fields(blob_data: bytes) -> dict:
+    """The FIELDS of a chat record, without parsing its (much larger) conversation.
+
+    A value is read after its '"field": "' marker; the quotes of such a marker would be escaped inside a JSON string
+    and the messages don't have these keys. When a value can't be read like that (e.g. it is null), the JSON is parsed.
+    """
+    row = {}
+    for field, marker in _FIELD_MARKERS.items():
+        # hashed_user comes after the conversation
+        position = blob_data.rfind(marker) if field == "hashed_user" else blob_data.find(marker)
+        start = position + len(marker)
+        end = blob_data.find(b'"', start) if position >= 0 else -1
+        if end < 0 or b"\\" in blob_data[start:end]:
+            json_data = json.loads(blob_data)
+            return {field: json_data.get(field, None) for field in FIELDS}
+        row[field] = blob_data[start:end].decode("utf-8")
+    return row
+
+
+def read_batches(
+    container_client: ContainerClient, blob_names: list[str], read_blob_names: list[str] | None = None
+) -> Iterator[pa.RecordBatch]:
+    """Record batches of at most BATCH_ROWS rows with FIELDS, one row for every chat blob.
+
+    The blobs are downloaded concurrently (see shared.blob_download); a blob that can't be downloaded or read is logged
+    and skipped. The names of the blobs that were downloaded are appended to read_blob_names, so a blob that failed to
+    download can be ingested by a later run (a blob that can't be read would fail again, so it counts as read).
+    """
+    logger = logging.getLogger("KS-FAQ")
+    columns = {field: [] for field in FIELDS}
+    for i, (blob_name, blob_data) in enumerate(download_blobs(container_client, blob_names, return_exceptions=True)):
+        try:
+            if isinstance(blob_data, Exception):
+                raise blob_data
+            if read_blob_names is not None:
+                read_blob_names.append(blob_name)
+            row = extract_fields(blob_data)
+            for field in FIELDS:
+                columns[field].append(row[field])
+        except Exception as e:
+            logger.warning(f"Failed to process blob {blob_name}: {e}")
+        if len(columns["session_uuid"]) == BATCH_ROWS:
+            yield pa.RecordBatch.from_pydict(columns, schema=SCHEMA)
+            columns = {field: [] for field in FIELDS}
+        if (i + 1) % PROGRESS_EVERY == 0 or i + 1 == len(blob_names):
+            logger.info(f"Read {i + 1} of {len(blob_names)} chat blobs.")
+    if columns["session_uuid"]:
+        yield pa.RecordBatch.from_pydict(columns, schema=SCHEMA)
+
+
+def ingest(
+    container_client: ContainerClient, watermark: UsageWatermark, today: date | None = None
+) -> tuple[pd.DataFrame, UsageWatermark]:
+    """The rows of the chat blobs that are new since the watermark (de-duplicated on KEY) and the updated watermark."""
+    logger = logging.getLogger("KS-FAQ")
+    today = today or date.today()
+    if watermark.last_date is not None and watermark.last_date >= (today - timedelta(days=1)).strftime("%Y%m%d"):
+        return pd.DataFrame(columns=FIELDS), watermark
+
+    blob_names = list_new_blobs(container_client, watermark, today)
+    logger.info(f"Ingesting {len(blob_names)} new chat blobs into the usage statistics.")
+    read_blob_names = []
+    table = pa.Table.from_batches(read_batches(container_client, blob_names, read_blob_names), schema=SCHEMA)
+    rows = table.to_pandas().dropna(subset=KEY).drop_duplicates(subset=KEY)
+    logger.info(f"Ingested {len(rows)} rows into the usage statistics.")
+    read = set(read_blob_names)
+    failed_blob_names = [blob_name for blob_name in blob_names if blob_name not in read]
+    if failed_blob_names:
+        logger.warning(f"{len(failed_blob_names)} chat blobs failed to download, they are ingested by a later run.")
+    return rows, watermark.updated(read_blob_names, today, failed_blob_names)
@@ -3,23 +3,29 @@ from datetime import datetime
 
 import streamlit as st
 from dotenv import load_dotenv
-from PIL import Image
 from streamlit_feedback import streamlit_feedback
 
 from webapp.helpers_webapp import (
     ENVIRONMENT,
+    IMG_SIDEBAR,
     FailSavingChat,
+    answer_question,
+    avatar,
     chain_rag,
     init_app,
     log_result_to_MS_teams,
     process_feedback,
+    refresh_vectorstore,
     save_chat,
     set_styling,
+    static_file,
 )
+from webapp.rag_pipeline import StreamingAnswerHandler
 
 load_dotenv()
 
 INITIAL_MESSAGES = [{"role": "assistant", "content": "Waar kan ik je mee helpen?"}]
+HISTORY_WINDOW = 20  # number of messages of the chat history that are shown, earlier ones are behind a toggle
 
 set_styling()
 init_app()
@@ -30,20 +36,29 @@ st.markdown("# Vraag het aan Ally")
 def init_chain_rag(k: int):
     """Initialize RAG chain using k chunks."""
     st.session_state["logger"].debug("Initializing RAG chain (in chat-app).")
-    return chain_rag(llm=st.session_state["llm"], vectorindex=st.session_state["vectorstore"], k=k)
+    return chain_rag(
+        llm=st.session_state["llm"],
+        vectorindex=st.session_state["vectorstore"],
+        k=k,
+        condense_llm=st.session_state["condense_llm"],
+    )
 
 
 # Sidebar & reset
 
 
 def reset_history():
-    """Clear chat history."""
+    """Clear chat history and switch to the most recent version of the faiss index."""
+    refresh_vectorstore()
     st.session_state["chain_rag"] = chain_rag(
         llm=st.session_state["llm"],
         vectorindex=st.session_state["vectorstore"],
         k=st.session_state.search_k,
+        condense_llm=st.session_state["condense_llm"],
     )
     st.session_state.messages = INITIAL_MESSAGES
+    st.session_state["conversation_nr"] = st.session_state.get("conversation_nr", 1) + 1
+    st.session_state["nr_saved_messages"] = 0
     st.session_state["feedback_key"] = None
 
 
@@ -65,7 +80,7 @@ def send_feedback(context: dict):
 
 
 with st.sidebar:
-    st.image(Image.open("./src/webapp/img/ALG_RGB_Robothuis.png"))
+    st.image(static_file(IMG_SIDEBAR))
     st.write(
         "Ally zal proberen je vragen te beantwoorden. Daarbij worden de meest relevante documenten uit de \
         kennisbank gebruikt."
@@ -97,7 +112,7 @@ if st.session_state["feedback_key"] is not None:
         }
         try:
             send_feedback({"rating": user_feedback["feedback_score"], "comment": user_feedback["feedback_text"]})
-            process_feedback(client=st.session_state["blob_client"], user_feedback=user_feedback, type_feedback="chat")
+            process_feedback(user_feedback=user_feedback, type_feedback="chat")
         except Exception as e:
             st.session_state["logger"].error(f"Opslaan van feedback is niet gelukt: {e}")
         st.toast("Bedankt voor je feedback!")
@@ -118,6 +133,8 @@ if "chain_rag" not in st.session_state:
 
 if "messages" not in st.session_state:
     st.session_state.messages = INITIAL_MESSAGES
+    st.session_state["conversation_nr"] = 1
+    st.session_state["nr_saved_messages"] = 0
 
 if "user" not in st.session_state:
     st.session_state.user = {}
@@ -133,29 +150,49 @@ if "UserPrincipalName" not in st.session_state.user or st.session_state.user["Us
 
 
 # Chat
-for message in st.session_state.messages:
-    # print chat history (recall that streamlit refreshes the page on every interaction)
+
+
+def show_message(message: dict):
+    """Show a message of the chat history, for the assistant with the sources."""
+    content = message["content"]
     if message["role"] == "assistant":
-        content = message["content"] + "\n\n"
+        content += "\n\n"
         for i in range(len(message.get("source_titles", []))):
             title = message["source_titles"][i]
             url = message["urls"][i]
             content += f"[{i + 1}. {title}]({url})  \n"
-        st.chat_message("assistant", avatar=Image.open("./src/webapp/img/icon-robot.png")).write(content)
-    else:
-        st.chat_message(message["role"], avatar=Image.open("./src/webapp/img/icon-chat.png")).write(message["content"])
+    st.chat_message(message["role"], avatar=avatar(message["role"])).write(content)
+
+
+@st.fragment
+def show_chat_history():
+    """Show the chat history (recall that streamlit refreshes the page on every interaction).
+
+    In long sessions only the last HISTORY_WINDOW messages are shown, unless the user turns on the toggle; that only
+    reruns this fragment, not the whole page.
+    """
+    messages = st.session_state.messages
+    nr_hidden = max(len(messages) - HISTORY_WINDOW, 0)
+    if nr_hidden and not st.toggle(f"Toon {nr_hidden} eerdere berichten", key="show_full_history"):
+        messages = messages[nr_hidden:]
+    for message in messages:
+        show_message(message)
+
+
+show_chat_history()
 
 
 if prompt := st.chat_input(placeholder="Stel je vraag hier"):
-    st.chat_message("user", avatar=Image.open("./src/webapp/img/icon-chat.png")).write(prompt)
+    st.chat_message("user", avatar=avatar("user")).write(prompt)
     st.session_state.messages.append({"role": "user", "content": prompt})
 
 
 if len(st.session_state.messages) > 1 and st.session_state.messages[-1]["role"] != "assistant":
-    with st.chat_message("assistant", avatar=Image.open("./src/webapp/img/icon-robot.png")):
+    with st.chat_message("assistant", avatar=avatar("assistant")):
+        answer_placeholder = st.empty()
         with st.spinner("Nadenken..."):
             try:
-                result = st.session_state.chain_rag({"question": prompt})
+                result = answer_question(prompt, stream_handler=StreamingAnswerHandler(answer_placeholder))
                 answer = result["answer"] + "\n\n"
                 urls = []
                 source_titles = []
@@ -165,26 +202,33 @@ if len(st.session_state.messages) > 1 and st.session_state.messages[-1]["role"]
                     answer += f"[{motivation}]({url})  \n"
                     urls.append(source_document.metadata["url"])
                     source_titles.append(source_document.metadata["source"])
-                st.write(answer)
+                answer_placeholder.markdown(answer)
 
                 message = {
                     "role": "assistant",
                     "content": result["answer"],
                     "source_titles": source_titles,
                     "urls": urls,
+                    "faiss_version": st.session_state["faiss_version"],
+                    "latency": result.get("latency"),
                 }
                 st.session_state.messages.append(message)
                 try:
+                    nr_saved_messages = st.session_state["nr_saved_messages"]
                     chat = {
                         "environment": ENVIRONMENT,
                         "session_uuid": st.session_state["session_uuid"],
                         "timestamp_last_chat": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                        "conversation": st.session_state["messages"],
+                        "faiss_version": st.session_state["faiss_version"],
+                        "conversation_nr": st.session_state["conversation_nr"],
+                        "turn": sum(msg["role"] == "user" for msg in st.session_state["messages"]),
+                        "messages": st.session_state["messages"][nr_saved_messages:],
                         "hashed_user": hashlib.sha512(
                             st.session_state.user["userPrincipalName"].encode("utf-8")
                         ).hexdigest(),
                     }
-                    save_chat(client=st.session_state["blob_client"], chat=chat)
+                    save_chat(chat=chat)
+                    st.session_state["nr_saved_messages"] = len(st.session_state["messages"])
                 except Exception as e:
                     raise FailSavingChat(message=f"Opslaan van chat is niet gelukt: {repr(e)}")
             except Exception as e:
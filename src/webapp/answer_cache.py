@@ -0,0 +1,158 @@
+"""Cache of answers to standalone questions.
+
+A first question (without chat history) is answered from the retrieved chunks only, so its answer depends on nothing but
+the question, the version of the faiss index and the number of chunks k. Those answers are cached, so the top FAQ
+questions don't need a gpt-4o call. A question also hits the cache when its embedding is nearly identical to the
+embedding of a cached question of the same index version and k.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from langchain.docstore.document import Document
+from pydantic import BaseModel
+
+from webapp.query_embedding_cache import normalize_query
+
+TTL_SECONDS = 12 * 60 * 60
+MAX_ENTRIES = 1000
+# Cosine similarity of the ada-002 embeddings above which another question gets the same answer (e.g. 0.97); with 1.0
+# only the same (normalized) question does
+SIMILARITY_THRESHOLD = 1.0
+
+_shared_caches = {}
+_shared_caches_lock = threading.Lock()
+
+
+class CachedAnswer(BaseModel):
+    """An answer with the chunks it is based on."""
+
+    question: str
+    answer: str
+    source_documents: list  # langchain Documents, these are pydantic v1 models that pydantic v2 can't validate
+    embedding: list[float]
+    created_at: float
+
+
+class AnswerCache:
+    """Thread-safe LRU cache with TTL of answers, per (faiss version, k).
+
+    Only answers for the faiss version that is currently loaded are kept: set_current_version drops the others.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float = TTL_SECONDS,
+        max_entries: int = MAX_ENTRIES,
+        similarity_threshold: float = SIMILARITY_THRESHOLD,
+    ):
+        """Create an empty cache."""
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.entries: OrderedDict[tuple[str, int, str], CachedAnswer] = OrderedDict()
+        self.current_version = None
+        self.lock = threading.Lock()
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.logger = logging.getLogger("KS-FAQ")
+
+    def set_current_version(self, faiss_version: str) -> None:
+        """Drop the answers based on other versions of the faiss index."""
+        with self.lock:
+            if faiss_version == self.current_version:
+                return
+            self.current_version = faiss_version
+            for key in [key for key in self.entries if key[0] != faiss_version]:
+                del self.entries[key]
+        self.logger.info(f"Answer cache now holds answers for faiss version {faiss_version}.")
+
+    def get(self, faiss_version: str, k: int, question: str, embedding: list[float]) -> CachedAnswer | None:
+        """Cached answer to the question, or to a near-duplicate question; None if there is none."""
+        key = (faiss_version, k, normalize_query(question))
+        with self.lock:
+            self._remove_expired()
+            cached = self.entries.get(key)
+            if cached is not None:
+                self.exact_hits += 1
+            else:
+                key = self._most_similar_key(faiss_version, k, embedding)
+                if key is not None:
+                    cached = self.entries[key]
+                    self.similar_hits += 1
+                else:
+                    self.misses += 1
+            if cached is not None:
+                self.entries.move_to_end(key)
+        self.logger.debug(f"Answer cache: {self.stats()}")
+        return cached
+
+    def put(
+        self,
+        faiss_version: str,
+        k: int,
+        question: str,
+        embedding: list[float],
+        answer: str,
+        source_documents: list[Document],
+    ) -> None:
+        """Cache an answer (only for the current version of the faiss index)."""
+        with self.lock:
+            if self.current_version is not None and faiss_version != self.current_version:
+                return
+            key = (faiss_version, k, normalize_query(question))
+            self.entries[key] = CachedAnswer(
+                question=question,
+                answer=answer,
+                source_documents=source_documents,
+                embedding=embedding,
+                created_at=time.time(),
+            )
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def _most_similar_key(self, faiss_version: str, k: int, embedding: list[float]) -> tuple[str, int, str] | None:
+        if self.similarity_threshold >= 1.0:
+            return None
+        keys = [key for key in self.entries if key[0] == faiss_version and key[1] == k]
+        if not keys:
+            return None
+        embeddings = np.array([self.entries[key].embedding for key in keys], dtype=np.float32)
+        query = np.asarray(embedding, dtype=np.float32)
+        similarities = embeddings @ query / (np.linalg.norm(embeddings, axis=1) * np.linalg.norm(query))
+        best = int(np.argmax(similarities))
+        return keys[best] if similarities[best] >= self.similarity_threshold else None
+
+    def _remove_expired(self) -> None:
+        oldest_allowed = time.time() - self.ttl_seconds
+        for key in [key for key, cached in self.entries.items() if cached.created_at < oldest_allowed]:
+            del self.entries[key]
+
+    def stats(self) -> dict:
+        """Hit-rate metrics of the cache."""
+        lookups = self.exact_hits + self.similar_hits + self.misses
+        return {
+            "lookups": lookups,
+            "exact_hits": self.exact_hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.exact_hits + self.similar_hits) / lookups, 3) if lookups else 0.0,
+            "entries": len(self.entries),
+        }
+
+
+def shared_answer_cache(
+    ttl_seconds: float = TTL_SECONDS,
+    max_entries: int = MAX_ENTRIES,
+    similarity_threshold: float = SIMILARITY_THRESHOLD,
+) -> AnswerCache:
+    """The process-wide answer cache for these settings (see shared_query_embedding_cache)."""
+    with _shared_caches_lock:
+        key = (ttl_seconds, max_entries, similarity_threshold)
+        if key not in _shared_caches:
+            _shared_caches[key] = AnswerCache(ttl_seconds, max_entries, similarity_threshold)
+        return _shared_caches[key]
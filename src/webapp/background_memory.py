@@ -0,0 +1,86 @@
+"""Conversation memory that summarizes the chat history in a background worker.
+
+ConversationSummaryBufferMemory summarizes the oldest messages with an LLM call inside save_context, so as part of
+every turn once the history is long, and recounts the tokens of the whole buffer for every message it prunes. This
+memory keeps a token count per message and summarizes in a worker thread after the answer is shown; until the new
+summary is ready, the next turn uses the previous summary with the (longer) buffer.
+"""
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any
+
+from langchain.memory import ConversationSummaryBufferMemory
+from langchain.memory.chat_memory import BaseChatMemory
+from langchain_core.pydantic_v1 import PrivateAttr
+
+SUMMARY_WORKERS = 2
+
+_summary_executor = ThreadPoolExecutor(max_workers=SUMMARY_WORKERS, thread_name_prefix="summarize")
+
+
+class BackgroundSummaryBufferMemory(ConversationSummaryBufferMemory):
+    """ConversationSummaryBufferMemory with incremental token counting and summarization off the request path."""
+
+    _lock: threading.RLock = PrivateAttr(default_factory=threading.RLock)
+    _token_counts: list[int] = PrivateAttr(default_factory=list)
+    _buffer_tokens: int = PrivateAttr(default=0)
+    _pending: Future | None = PrivateAttr(default=None)
+
+    def load_memory_variables(self, inputs: dict[str, Any]) -> dict[str, Any]:
+        """Return the latest summary and the messages that are not summarized yet."""
+        with self._lock:
+            return super().load_memory_variables(inputs)
+
+    def save_context(self, inputs: dict[str, Any], outputs: dict[str, str]) -> None:
+        """Save the turn to the buffer and start summarizing in the background when it exceeds max_token_limit."""
+        with self._lock:
+            nr_messages = len(self.chat_memory.messages)
+            BaseChatMemory.save_context(self, inputs, outputs)
+            for message in self.chat_memory.messages[nr_messages:]:
+                tokens = self.llm.get_num_tokens_from_messages([message])
+                self._token_counts.append(tokens)
+                self._buffer_tokens += tokens
+            if self._buffer_tokens > self.max_token_limit and (self._pending is None or self._pending.done()):
+                self._pending = _summary_executor.submit(self._summarize)
+
+    def _summarize(self) -> None:
+        """Summarize the oldest messages until the buffer fits within max_token_limit again."""
+        try:
+            while True:
+                with self._lock:
+                    nr_to_prune = 0
+                    remaining_tokens = self._buffer_tokens
+                    while remaining_tokens > self.max_token_limit and nr_to_prune < len(self._token_counts):
+                        remaining_tokens -= self._token_counts[nr_to_prune]
+                        nr_to_prune += 1
+                    if nr_to_prune == 0:
+                        return
+                    pruned_messages = self.chat_memory.messages[:nr_to_prune]
+                    summary = self.moving_summary_buffer
+
+                # The LLM call happens outside the lock, so the next turn can read the memory in the meantime
+                new_summary = self.predict_new_summary(pruned_messages, summary)
+
+                with self._lock:
+                    if self.chat_memory.messages[:nr_to_prune] != pruned_messages:
+                        return  # the memory was cleared in the meantime
+                    del self.chat_memory.messages[:nr_to_prune]
+                    self._buffer_tokens -= sum(self._token_counts[:nr_to_prune])
+                    del self._token_counts[:nr_to_prune]
+                    self.moving_summary_buffer = new_summary
+        except Exception as e:
+            logging.getLogger("KS-FAQ").error(f"Summarizing the chat history failed: {repr(e)}")
+
+    def wait_for_summary(self, timeout: float | None = None) -> None:
+        """Block until a running summarization is done (for scripts and tests)."""
+        pending = self._pending
+        if pending is not None:
+            pending.result(timeout=timeout)
+
+    def clear(self) -> None:
+        """Clear memory contents."""
+        with self._lock:
+            super().clear()
+            self._token_counts = []
+            self._buffer_tokens = 0
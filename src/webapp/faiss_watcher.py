@@ -0,0 +1,83 @@
+"""Keeps the most recent faiss index loaded, one watcher per process.
+
+A background thread polls the datalake for a newer version of the index, loads it off the request path and then swaps
+it in. Sessions keep the version they started with until they start a new chat.
+"""
+import logging
+import threading
+import time
+from typing import Callable
+
+from langchain_community.vectorstores import FAISS
+
+POLL_INTERVAL_SECONDS = 300
+
+_shared_watcher = None
+_shared_watcher_lock = threading.Lock()
+
+
+class FaissWatcher:
+    """Loads the index and keeps the most recent version of it loaded."""
+
+    def __init__(
+        self,
+        load: Callable[[str | None], tuple[FAISS, str]],
+        latest_version: Callable[[], str],
+        on_new_version: Callable[[str], None],
+        poll_interval: int = POLL_INTERVAL_SECONDS,
+    ):
+        """Load the current index and start watching for new versions.
+
+        load loads a version of the index (the most recent one for None), latest_version gives the most recent version
+        on the datalake and on_new_version is called with every version that is loaded.
+        """
+        self.load = load
+        self.latest_version = latest_version
+        self.on_new_version = on_new_version
+        self.poll_interval = poll_interval
+        self.logger = logging.getLogger("KS-FAQ")
+        self.lock = threading.Lock()
+        self.vectorstore, self.version = load(None)
+        on_new_version(self.version)
+        self.thread = threading.Thread(target=self._watch, name="faiss-watcher", daemon=True)
+        self.thread.start()
+
+    def current(self) -> tuple[FAISS, str]:
+        """The most recent index that is loaded and its version."""
+        with self.lock:
+            return self.vectorstore, self.version
+
+    def _watch(self):
+        """Poll for a new version of the index and load it."""
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                latest_version = self.latest_version()
+                if latest_version == self.version:
+                    continue
+                self.logger.info(f"New FAISS index version found: {latest_version}, loading it.")
+                vectorstore, version = self.load(latest_version)
+                with self.lock:
+                    self.vectorstore, self.version = vectorstore, version
+                self.on_new_version(version)
+                self.logger.info(f"FAISS index version {version} is now used for new chats.")
+            except Exception as e:
+                self.logger.error(f"Checking for a new FAISS index version failed: {repr(e)}")
+
+
+def shared_faiss_watcher(
+    load: Callable[[str | None], tuple[FAISS, str]],
+    latest_version: Callable[[], str],
+    on_new_version: Callable[[str], None],
+    poll_interval: int = POLL_INTERVAL_SECONDS,
+) -> FaissWatcher:
+    """The process-wide watcher, created (and the index loaded) by the first call.
+
+    This is not an st.cache_resource, because the pages import helpers_webapp under another module name than the main
+    page does, and would load the index and start a watcher of their own.
+    """
+    global _shared_watcher
+    with _shared_watcher_lock:
+        if _shared_watcher is None:
+            _shared_watcher = FaissWatcher(load, latest_version, on_new_version, poll_interval)
+        return _shared_watcher
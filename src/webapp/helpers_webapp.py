@@ -1,6 +1,9 @@
+import hashlib
 import json
 import logging
 import os
+import tempfile
+import time
 import uuid
 from datetime import datetime
 from pathlib import Path
@@ -8,24 +11,59 @@ from pathlib import Path
 import pandas as pd
 import pymsteams
 import streamlit as st
+from azure.core import MatchConditions
 from azure.identity import DefaultAzureCredential
-from azure.storage.blob import BlobServiceClient, ContainerClient
-from langchain.chains import ConversationalRetrievalChain
+from azure.storage.blob import ContainerClient
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.chains import ConversationalRetrievalChain, LLMChain
 from langchain.chains.conversational_retrieval.base import (
     BaseConversationalRetrievalChain,
 )
-from langchain.memory import ConversationSummaryBufferMemory
+from langchain.chains.question_answering import load_qa_chain
 from langchain.prompts import PromptTemplate
 from langchain_community.vectorstores import FAISS
 from langchain_core.messages import BaseMessage
 from langchain_openai import AzureChatOpenAI, AzureOpenAIEmbeddings
 
+from shared import usage_aggregates
+from shared.chat_records import turn_blob_name
+from shared.chunk_store import load_faiss
+from webapp.answer_cache import AnswerCache, shared_answer_cache
+from webapp.background_memory import BackgroundSummaryBufferMemory
+from webapp.faiss_watcher import FaissWatcher, shared_faiss_watcher
+from webapp.query_embedding_cache import (
+    CachedQueryEmbeddings,
+    QueryEmbeddingCache,
+    shared_query_embedding_cache,
+)
+from webapp.rag_pipeline import (
+    STAGE_ANSWER,
+    STAGE_CONDENSE,
+    STAGE_RETRIEVE,
+    CondenseQuestionChain,
+    StageLatencyHandler,
+)
+from webapp.upload_queue import UploadQueue, shared_upload_queue
+
 LOCAL_FOLDER_FAISS = "data/faiss"
+LOCAL_FOLDER_UPLOAD_SPILL = "data/upload_spill"  # chats and feedback that couldn't be uploaded yet
+FAISS_POLL_INTERVAL_SECONDS = 300
+KEEP_LOCAL_FAISS_VERSIONS = 2  # the version in use and the previous one
+FAISS_LOAD_MMAP = os.environ.get("APP_FAISS_MMAP", "true") == "true"  # memory-map the index, shared between processes
 
 EMBEDDINGS_MODEL = "webapps-text-embedding-ada-002"
 OPENAI_EMBEDDINGS_API_VERSION = "2023-05-15"
+QUERY_EMBEDDING_CACHE_SIZE = int(os.environ.get("APP_QUERY_EMBEDDING_CACHE_SIZE", "10000"))
+QUERY_EMBEDDING_CACHE_PATH = os.environ.get("APP_QUERY_EMBEDDING_CACHE_PATH")  # e.g. data/query_embeddings.sqlite
+ANSWER_CACHE_TTL_SECONDS = int(os.environ.get("APP_ANSWER_CACHE_TTL_SECONDS", str(12 * 60 * 60)))
+ANSWER_CACHE_MAX_ENTRIES = 1000
+# Near-duplicate questions above this similarity (e.g. 0.97) share a cached answer; by default only the same question
+ANSWER_CACHE_SIMILARITY_THRESHOLD = float(os.environ.get("APP_ANSWER_CACHE_SIMILARITY_THRESHOLD", "1.0"))
 
 CHAT_MODEL = "gpt-4o"
+# Deployment of a small, fast model to condense questions (e.g. gpt-4o-mini); by default the chat model is used
+CONDENSE_MODEL = os.environ.get("APP_CONDENSE_MODEL", CHAT_MODEL)
+FAST_PIPELINE = os.environ.get("APP_FAST_PIPELINE", "true") == "true"
 OPENAI_CHAT_API_VERSION = "2024-08-01-preview"
 
 MAX_TOKEN_LIMIT_BSUMMARY = 4000
@@ -33,16 +71,35 @@ MAX_TOKEN_LIMIT_BSUMMARY = 4000
 ENVIRONMENT = os.environ.get("APP_ENVIRONMENT", "tst")
 BUILD_TAG = os.environ.get("APP_BUILD_TAG", "-")
 BASE_PATH_STORAGE = f"klantenservice-chatbot-medewerker/{ENVIRONMENT}"
+# Published by the reporting job of the environment of the datalake, the dev job publishes in the tst folder
+USAGE_AGGREGATES_PATH = (
+    f"klantenservice-chatbot-medewerker/{'prd' if ENVIRONMENT == 'prd' else 'tst'}/{usage_aggregates.AGGREGATES_BLOB}"
+)
 LOG_LEVEL = "DEBUG"
 
+STYLES_CSS = "src/webapp/styles.css"
+IMG_SIDEBAR = "src/webapp/img/ALG_RGB_Robothuis.png"
+AVATAR_ASSISTANT = "src/webapp/img/icon-robot.png"
+AVATAR_USER = "src/webapp/img/icon-chat.png"
+
 
 def set_styling():
     """Sets all the styling for the app, including CSS styling and de Alliantie logo in sidebar."""
     st.set_page_config(page_title="Vraag het aan Ally", page_icon="src/webapp/img/alliantie_logo.png")
 
     st.logo("src/webapp/img/logo_wit.png", size="small")
-    with open("src/webapp/styles.css") as css:
-        st.markdown(f"<style>{css.read()}</style>", unsafe_allow_html=True)
+    st.markdown(f"<style>{static_file(STYLES_CSS).decode('utf-8')}</style>", unsafe_allow_html=True)
+
+
+@st.cache_resource
+def static_file(path: str) -> bytes:
+    """Content of a static file (CSS, images), read once per process."""
+    return Path(path).read_bytes()
+
+
+def avatar(role: str) -> bytes:
+    """Avatar image of the assistant or the user (as PNG bytes, so Streamlit doesn't decode and re-encode it)."""
+    return static_file(AVATAR_ASSISTANT if role == "assistant" else AVATAR_USER)
 
 
 def chat_llm():
@@ -57,6 +114,17 @@ def chat_llm():
     )
 
 
+def condense_llm():
+    """Initialize the LLM that condenses follow-up questions."""
+    return AzureChatOpenAI(
+        deployment_name=CONDENSE_MODEL,
+        azure_endpoint=os.environ["OPENAI_SWEDEN_ENDPOINT"],
+        openai_api_key=os.environ["OPENAI_SWEDEN"],
+        api_version=OPENAI_CHAT_API_VERSION,
+        temperature=0,
+    )
+
+
 def embeddings() -> AzureOpenAIEmbeddings:
     """Initialize embeddings."""
     return AzureOpenAIEmbeddings(
@@ -81,35 +149,110 @@ def container_client() -> ContainerClient:
     )
 
 
-def vectorindex(embeddings: AzureOpenAIEmbeddings) -> tuple[FAISS, str]:
-    """Initialize faiss index."""
-    Path("data/faiss").mkdir(parents=True, exist_ok=True)
+def latest_faiss_version(client: ContainerClient) -> str:
+    """Version of the most recent complete faiss index on the datalake (expects filenames like index_DATETIME.faiss).
+
+    A version only counts when all its files are there: the index, the chunk store and the manifest (or the pickled
+    docstore of indexes built before the chunk store), so a version that is still being uploaded is never picked.
+    """
+    prefix = f"{BASE_PATH_STORAGE}/faiss/index_"
+    extensions = {}
+    for blob_name in client.list_blob_names(name_starts_with=prefix):
+        version_name, _, extension = blob_name.removeprefix(prefix).rpartition(".")
+        extensions.setdefault(version_name, set()).add(extension)
+    complete_versions = [
+        version_name
+        for version_name, found in extensions.items()
+        if {"faiss", "docs", "json"} <= found or {"faiss", "pkl"} <= found
+    ]
+    if not complete_versions:
+        raise FileNotFoundError(f"No complete faiss index found on the datalake under {prefix}*.")
+    return max(complete_versions)
+
+
+def vectorindex(embeddings: AzureOpenAIEmbeddings, version_name: str | None = None) -> tuple[FAISS, str]:
+    """Initialize faiss index (the most recent version, unless a version is given)."""
+    Path(LOCAL_FOLDER_FAISS).mkdir(parents=True, exist_ok=True)
     client = container_client()
 
-    # List all the available faiss indexes
-    blob_list = client.list_blobs(name_starts_with=f"{BASE_PATH_STORAGE}/faiss/index")
-    filenames = []
-    for blob in blob_list:
-        filename = blob["name"].split(f"{BASE_PATH_STORAGE}/faiss/")[1]
-        filenames.append(filename)
-
-    # Extract the two most recent files
-    index_files = sorted(filenames)[-2:]
-
-    # Extract the version name (expects a filename in this format: index_DATETIME.pkl)
-    version_name = index_files[-1].split(".")[0].split("index_")[1]
-
-    for filename in index_files:
-        filename_no_extension = filename.split(".")[0]
-        filepath = f"{BASE_PATH_STORAGE}/faiss/{filename}"
-        with open(f"data/faiss/{filename}", "wb") as f:
-            blob_data = client.download_blob(filepath).readall()
-            f.write(blob_data)
-
-    return (
-        FAISS.load_local(folder_path=LOCAL_FOLDER_FAISS, embeddings=embeddings, index_name=filename_no_extension),
-        version_name,
-    )
+    if version_name is None:
+        version_name = latest_faiss_version(client)
+
+    filename_no_extension = f"index_{version_name}"
+    # Indexes built before the chunk store (index_DATETIME.docs) was introduced only have the pickled docstore
+    has_chunk_store = client.get_blob_client(f"{BASE_PATH_STORAGE}/faiss/{filename_no_extension}.docs").exists()
+    for extension in ["faiss", "docs", "json"] if has_chunk_store else ["faiss", "pkl"]:
+        download_if_changed(client, f"{filename_no_extension}.{extension}")
+    remove_old_faiss_versions(keep=KEEP_LOCAL_FAISS_VERSIONS)
+
+    if has_chunk_store:
+        # The manifest records the index type (index_factory) and its search parameters, e.g. nprobe for IVF
+        with open(Path(LOCAL_FOLDER_FAISS) / f"{filename_no_extension}.json", "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        vectorstore = load_faiss(
+            LOCAL_FOLDER_FAISS,
+            filename_no_extension,
+            embeddings,
+            mmap_index=FAISS_LOAD_MMAP,
+            search_parameters=manifest.get("search_parameters"),
+        )
+    else:
+        vectorstore = FAISS.load_local(
+            folder_path=LOCAL_FOLDER_FAISS, embeddings=embeddings, index_name=filename_no_extension
+        )
+    return vectorstore, version_name
+
+
+def download_if_changed(client: ContainerClient, filename: str) -> None:
+    """Download a faiss file, unless the same file (same etag or MD5) is already in the local folder.
+
+    The blob is streamed to a temporary file that is renamed when complete, so other processes never read a partial
+    file.
+    """
+    blob_client = client.get_blob_client(f"{BASE_PATH_STORAGE}/faiss/{filename}")
+    properties = blob_client.get_blob_properties()
+    content_md5 = properties.content_settings.content_md5
+    local_path = Path(LOCAL_FOLDER_FAISS) / filename
+    etag_path = local_path.with_name(local_path.name + ".etag")
+
+    if local_path.exists():
+        if etag_path.exists() and etag_path.read_text() == properties.etag:
+            return
+        if content_md5 and _md5(local_path) == bytes(content_md5):
+            etag_path.write_text(properties.etag)
+            return
+
+    with tempfile.NamedTemporaryFile(dir=LOCAL_FOLDER_FAISS, prefix=f".{filename}.", delete=False) as tmp:
+        try:
+            download = blob_client.download_blob(etag=properties.etag, match_condition=MatchConditions.IfNotModified)
+            download.readinto(tmp)
+        except Exception:
+            tmp.close()
+            os.unlink(tmp.name)
+            raise
+    if content_md5 and _md5(Path(tmp.name)) != bytes(content_md5):
+        os.remove(tmp.name)
+        raise ValueError(f"MD5 of downloaded {filename} does not match the blob.")
+    os.replace(tmp.name, local_path)
+    etag_path.write_text(properties.etag)
+
+
+def remove_old_faiss_versions(keep: int) -> None:
+    """Remove the local files of all but the most recent versions of the faiss index."""
+    local_files = list(Path(LOCAL_FOLDER_FAISS).glob("index_*"))
+    versions = sorted({f.name.split(".")[0] for f in local_files})
+    for f in local_files:
+        if f.name.split(".")[0] not in versions[-keep:]:
+            f.unlink(missing_ok=True)
+
+
+def _md5(path: Path) -> bytes:
+    """MD5 of a local file, read in blocks."""
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(4 * 1024 * 1024), b""):
+            md5.update(block)
+    return md5.digest()
 
 
 # Helpers for RAG chain
@@ -149,35 +292,96 @@ def get_chat_history_dutch(chat_history: list[BaseMessage]) -> str:
     return buffer
 
 
-def chain_rag(llm: AzureChatOpenAI, vectorindex: FAISS, k: int) -> BaseConversationalRetrievalChain:
-    """Initialize RAG chain with memory and summarization."""
-    memory = ConversationSummaryBufferMemory(
+def chain_rag(
+    llm: AzureChatOpenAI, vectorindex: FAISS, k: int, condense_llm: AzureChatOpenAI | None = None
+) -> BaseConversationalRetrievalChain:
+    """Initialize RAG chain with memory and summarization (in the background).
+
+    With a condense_llm (the fast pipeline) self-contained follow-up questions are not condensed, the other follow-up
+    questions are condensed by condense_llm instead of llm.
+    """
+    memory = BackgroundSummaryBufferMemory(
         memory_key="chat_history",
         return_messages=True,
         llm=llm,
         output_key="answer",
         max_token_limit=MAX_TOKEN_LIMIT_BSUMMARY,
     )
-    retriever = vectorindex.as_retriever(search_kwargs={"k": k})
-    return ConversationalRetrievalChain.from_llm(
-        llm=llm,
+    retriever = vectorindex.as_retriever(search_kwargs={"k": k}, tags=[STAGE_RETRIEVE])
+    condense_question_prompt = PromptTemplate(
+        input_variables=["chat_history", "question"],
+        template=(
+            "Jij bent een assistent die praat met een medewerker van de klantenservice van de Alliantie. "
+            "De Alliantie is een woningcorporatie. Gegeven het volgende gesprek en de vervolgvraag van de klant, herformuleer dit "  # noqa: E501
+            "als een op zichzelf staande vraag.\n\nChatgeschiedenis:\n{chat_history}\n\n"
+            "Vervolgvraag: {question}\n\nHergeformuleerde vraag:"
+        ),
+    )
+    if condense_llm is None:
+        question_generator = LLMChain(llm=llm, prompt=condense_question_prompt, tags=[STAGE_CONDENSE])
+    else:
+        question_generator = CondenseQuestionChain(
+            llm=condense_llm, prompt=condense_question_prompt, tags=[STAGE_CONDENSE]
+        )
+    return ConversationalRetrievalChain(
         retriever=retriever,  # compression_retriever
-        condense_question_prompt=PromptTemplate(
-            input_variables=["chat_history", "question"],
-            template=(
-                "Jij bent een assistent die praat met een medewerker van de klantenservice van de Alliantie. "
-                "De Alliantie is een woningcorporatie. Gegeven het volgende gesprek en de vervolgvraag van de klant, herformuleer dit "  # noqa: E501
-                "als een op zichzelf staande vraag.\n\nChatgeschiedenis:\n{chat_history}\n\n"
-                "Vervolgvraag: {question}\n\nHergeformuleerde vraag:"
-            ),
+        question_generator=question_generator,
+        combine_docs_chain=load_qa_chain(
+            llm, chain_type="stuff", prompt=_prompt_template_combine_docs(), tags=[STAGE_ANSWER]
         ),
-        combine_docs_chain_kwargs={"prompt": _prompt_template_combine_docs()},
         memory=memory,
         return_source_documents=True,
         get_chat_history=get_chat_history_dutch,
     )
 
 
+def answer_question(question: str, stream_handler: BaseCallbackHandler | None = None) -> dict:
+    """Answer a question with the RAG chain of the session.
+
+    The first question of a chat doesn't depend on chat history, so it is answered from the answer cache when the same
+    (or a nearly identical) question was asked before with the same faiss version and k. The stream_handler receives
+    the tokens of the answer while it is generated.
+    """
+    chain = st.session_state["chain_rag"]
+    if chain.memory.buffer:
+        return _timed_chain_call(chain, question, stream_handler)
+
+    faiss_version = st.session_state["faiss_version"]
+    k = chain.retriever.search_kwargs["k"]
+    # The query embedding cache keeps this embedding for the retriever, so this doesn't add a request
+    embedding = st.session_state["embeddings"].embed_query(question)
+    answer_cache = init_answer_cache()
+    cached = answer_cache.get(faiss_version, k, question, embedding)
+    if cached is not None:
+        st.session_state["logger"].debug(f"Answer from cache (question asked before: '{cached.question}').")
+        chain.memory.save_context({"question": question}, {"answer": cached.answer})
+        return {"question": question, "answer": cached.answer, "source_documents": cached.source_documents}
+
+    result = _timed_chain_call(chain, question, stream_handler)
+    answer_cache.put(faiss_version, k, question, embedding, result["answer"], result["source_documents"])
+    return result
+
+
+def _timed_chain_call(
+    chain: BaseConversationalRetrievalChain, question: str, stream_handler: BaseCallbackHandler | None = None
+) -> dict:
+    """Run the chain and add the latency per stage (in seconds) to the result under "latency".
+
+    "memory" is the time outside the condense, retrieve and answer stages: mostly loading the chat history and
+    summarizing it.
+    """
+    latency_handler = StageLatencyHandler()
+    start = time.perf_counter()
+    callbacks = [latency_handler] if stream_handler is None else [latency_handler, stream_handler]
+    result = chain({"question": question}, callbacks=callbacks)
+    total = time.perf_counter() - start
+    latency = {stage: round(seconds, 3) for stage, seconds in latency_handler.timings.items()}
+    latency["memory"] = round(total - sum(latency_handler.timings.values()), 3)
+    latency["total"] = round(total, 3)
+    st.session_state["logger"].info(f"Latency per stage (s): {latency}")
+    return {**result, "latency": latency}
+
+
 # Helpers for logging
 
 
@@ -213,18 +417,55 @@ def init_llm() -> AzureChatOpenAI:
     return chat_llm()
 
 
+def init_query_embedding_cache() -> QueryEmbeddingCache:
+    """Initialize the cache of query embeddings (one per process, it outlives the embeddings client)."""
+    return shared_query_embedding_cache(
+        EMBEDDINGS_MODEL, max_entries=QUERY_EMBEDDING_CACHE_SIZE, path=QUERY_EMBEDDING_CACHE_PATH
+    )
+
+
+def init_answer_cache() -> AnswerCache:
+    """Initialize the cache of answers to first questions (one per process)."""
+    return shared_answer_cache(
+        ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+        max_entries=ANSWER_CACHE_MAX_ENTRIES,
+        similarity_threshold=ANSWER_CACHE_SIMILARITY_THRESHOLD,
+    )
+
+
 @st.cache_resource(ttl="4h")
-def init_embeddings() -> AzureOpenAIEmbeddings:
-    """Initialize embeddings."""
+def init_condense_llm() -> AzureChatOpenAI:
+    """Initialize the LLM that condenses follow-up questions."""
+    st.session_state["logger"].debug("Initializing condense LLM in chat-app.")
+    return condense_llm()
+
+
+@st.cache_resource(ttl="4h")
+def init_embeddings() -> CachedQueryEmbeddings:
+    """Initialize embeddings, of which the query embeddings are cached."""
     st.session_state["logger"].debug("Initializing embeddings in chat-app.")
-    return embeddings()
+    return CachedQueryEmbeddings(embeddings(), init_query_embedding_cache())
+
+
+def init_faiss() -> FaissWatcher:
+    """Initialize faiss index (one watcher per process, it picks up new versions of the index by itself)."""
+    embeddings = st.session_state["embeddings"]
+    return shared_faiss_watcher(
+        load=lambda version_name: vectorindex(embeddings, version_name=version_name),
+        latest_version=lambda: latest_faiss_version(container_client()),
+        on_new_version=lambda version: init_answer_cache().set_current_version(version),
+        poll_interval=FAISS_POLL_INTERVAL_SECONDS,
+    )
 
 
-@st.cache_resource(ttl="24h")  # to be adjusted when we build automated update of FAISS index
-def init_faiss() -> FAISS:
-    """Initialize faiss index."""
-    st.session_state["logger"].debug("Initializing FAISS in chat-app.")
-    return vectorindex(st.session_state["embeddings"])
+def refresh_vectorstore():
+    """Let the session use the most recent faiss index (when starting a new chat)."""
+    st.session_state["vectorstore"], st.session_state["faiss_version"] = init_faiss().current()
+
+
+def init_upload_queue() -> UploadQueue:
+    """Initialize the queue that uploads chats and feedback in the background (one per process)."""
+    return shared_upload_queue(container_client, spill_dir=LOCAL_FOLDER_UPLOAD_SPILL)
 
 
 @st.cache_resource(ttl="4h")
@@ -243,10 +484,12 @@ def init_app():
         st.session_state["logger"] = create_logger()
     if "llm" not in st.session_state:
         st.session_state["llm"] = init_llm()
+    if "condense_llm" not in st.session_state:
+        st.session_state["condense_llm"] = init_condense_llm() if FAST_PIPELINE else None
     if "embeddings" not in st.session_state:
         st.session_state["embeddings"] = init_embeddings()
     if "vectorstore" not in st.session_state:
-        st.session_state["vectorstore"], st.session_state["faiss_version"] = init_faiss()
+        refresh_vectorstore()
     if "blob_client" not in st.session_state:
         st.session_state["blob_client"] = init_blob_client()
 
@@ -254,133 +497,14 @@ def init_app():
 # Helpers for feedback & reporting
 
 
-def blob_name_to_datetime(blob_name: str) -> datetime:
-    """Extracts the datetime from blob name.
-
-    Args: blob_name (str): The name of the blob, expected to contain a timestamp in the format YYYYMMDDHHMMSS
-
-    example: '20251113115003_4575337f-2fba-4d3e-8b68-408f56c8e5e2_115105.json'.
-    """
-    timestamp_str = blob_name.split("/")[-1].split("_")[0]
-    return datetime.strptime(timestamp_str, "%Y%m%d%H%M%S")
-
-
-def retrieve_usage_statistics(starting_from: datetime | None):
-    """Reads the production usage statistics JSONs from the datalake and returns a DataFrame.
-
-    If starting_from is provided, only blobs with a timestamp after starting_from, and before today, are included.
-    """
-
-    # Initialize a list to store the data
-    data = []
-
-    OTAP = "prd"
-    DATALAKE_LOGGING_BASE_PATH = f"klantenservice-chatbot-medewerker/{OTAP}/chat/"
-    ACCOUNT_NAME = os.environ["DATALAKE_NAME_PRD"]
-
-    # List all blobs in the specified folder
-    container_name = "ds-files"
-    blob_service_client = BlobServiceClient(
-        f"https://{ACCOUNT_NAME}.blob.core.windows.net", credential=DefaultAzureCredential(logging_enable=False)
-    )
-    container_client = blob_service_client.get_container_client(container_name)
-    blob_list = container_client.list_blobs(name_starts_with=DATALAKE_LOGGING_BASE_PATH)
-    for i, blob in enumerate(blob_list):
-        if blob.name.endswith(".json"):
-            blob_datetime = blob_name_to_datetime(blob.name)
-
-            if starting_from is not None:
-
-                # Check if the blob's datetime is after the starting_from date and excludes today.
-                if (blob_datetime.date() >= starting_from.date()) and (blob_datetime.date() < datetime.now().date()):
-                    st.session_state["logger"].info(f"Trying to download blob {i}: {blob.name}...")
-                    blob_client = container_client.get_blob_client(blob.name)
-                    blob_data = blob_client.download_blob().readall()
-                else:
-                    continue
-
-            else:
-                if blob_datetime.date() < datetime.now().date():
-                    st.session_state["logger"].info(f"Trying to download blob {i}: {blob.name}...")
-                    blob_client = container_client.get_blob_client(blob.name)
-                    blob_data = blob_client.download_blob().readall()
-                else:
-                    continue
-            try:
-                json_data = json.loads(blob_data)
-                row = {
-                    "environment": json_data.get("environment", None),
-                    "session_uuid": json_data.get("session_uuid", None),
-                    "timestamp_last_chat": json_data.get("timestamp_last_chat", None),
-                    "hashed_user": json_data.get("hashed_user", None),
-                }
-                data.append(row)
-            except Exception as e:
-                st.session_state["logger"].warning(f"Failed to process blob {blob.name}: {e}")
-
-    # Create a DataFrame from the data
-    df = pd.DataFrame(data)
-
-    if starting_from is not None:
-        return df
-
-    # Calculate statistics
-    num_rows = len(df)
-    num_unique_sessions = df["session_uuid"].nunique() if "session_uuid" in df.columns else 0
-    num_unique_users = df["hashed_user"].nunique() if "hashed_user" in df.columns else 0
-
-    print(f"Total questions asked: {num_rows}")
-    print(f"Unique session_uuid's: {num_unique_sessions}")
-    print(f"Unique hashed_user's: {num_unique_users}")
-
-    # Save the DataFrame as a Parquet file
-    df.to_parquet(
-        f"data/usage_statistics/{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}_usage_statistics.parquet", index=False
-    )
-
-    return df
-
-
-def update_usage_statistics():
-    """Updates the usage_statistics file."""
-
-    if os.path.exists("data/usage_statistics"):
-        files = [
-            f for f in os.listdir("data/usage_statistics/") if os.path.isfile(os.path.join("data/usage_statistics/", f))
-        ]
-        if len(files) >= 1:
-            print("Existing usage statistics found, updating with new data...")
-            for file in files:
-                date_last_update = datetime.strptime(file.split("_")[0], "%Y%m%d")
-
-                print("Retrieving usage statistics newer than ", date_last_update)
-
-                # Extract usage statistics that are newer than date_last_update
-                df_new = retrieve_usage_statistics(starting_from=date_last_update)
-                print("Retrieved ", len(df_new), " new records.")
-
-                # Get the old usage statistics
-                df_old = pd.read_parquet(f"data/usage_statistics/{file}")
-
-                # Merge old and new statistics
-                df_merged = pd.concat([df_old, df_new], ignore_index=True)
-
-                print("Saving updated usage statistics with ", len(df_merged), " total records.")
-                df_merged.to_parquet(
-                    f"data/usage_statistics/{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}_usage_statistics.parquet"
-                )
-
-                # Remove the old file
-                os.remove(f"data/usage_statistics/{file}")
-        else:
-            # Case when a folder is present but there is no statistics file in it.
-            print("No existing usage statistics found, retrieving all usage statistics up to this point...")
-            _ = retrieve_usage_statistics(starting_from=None)
-    else:
-        # Case when no folder is present
-        print("No existing usage statistics found, retrieving all usage statistics up to this point...")
-        os.makedirs("data/usage_statistics", exist_ok=False)
-        _ = retrieve_usage_statistics(starting_from=None)
+@st.cache_data(ttl="1h")
+def load_usage_aggregates() -> pd.DataFrame:
+    """Daily usage aggregates published by scheduled_runs/publish_usage_statistics.py; empty when there are none yet."""
+    blob_client = container_client().get_blob_client(USAGE_AGGREGATES_PATH)
+    if not blob_client.exists():
+        return pd.DataFrame(columns=usage_aggregates.COLUMNS)
+    aggregates, _ = usage_aggregates.from_parquet_bytes(blob_client.download_blob().readall())
+    return aggregates
 
 
 def log_result_to_MS_teams(result: str, otap: str) -> None:
@@ -407,24 +531,14 @@ def log_result_to_MS_teams(result: str, otap: str) -> None:
     return None
 
 
-def process_feedback(client: BlobServiceClient, user_feedback: dict, type_feedback: str):
-    """Process feedback."""
-    Path(f"data/feedback/{type_feedback}").mkdir(parents=True, exist_ok=True)
+def process_feedback(user_feedback: dict, type_feedback: str):
+    """Process feedback (it is uploaded in the background)."""
     filename = f"{user_feedback['session_uuid']}-{user_feedback['timestamp_feedback']}.json"
-    filepath = f"data/feedback/{type_feedback}/{filename}"
-    with open(filepath, "w") as feedbackfile:
-        json.dump(user_feedback, feedbackfile)
-    with open(filepath, "rb") as feedbackfile:
-        client.upload_blob(name=f"{BASE_PATH_STORAGE}/feedback/{type_feedback}/{filename}", data=feedbackfile.read())
-
-
-def save_chat(client: BlobServiceClient, chat: dict):
-    """Save chat."""
-    Path("data/chats_json").mkdir(parents=True, exist_ok=True)
-    timestamp_no_date = chat["timestamp_last_chat"][11:].replace(":", "")
-    filename = f"{chat['session_uuid']}_{timestamp_no_date}.json"
-    filepath = f"data/chats_json/{filename}"
-    with open(filepath, "w") as chatfile:
-        json.dump(chat, chatfile)
-    with open(filepath, "rb") as chatfile:
-        client.upload_blob(name=f"{BASE_PATH_STORAGE}/chat/{filename}", data=chatfile.read())
+    init_upload_queue().enqueue(
+        f"{BASE_PATH_STORAGE}/feedback/{type_feedback}/{filename}", json.dumps(user_feedback).encode("utf-8")
+    )
+
+
+def save_chat(chat: dict):
+    """Save a turn of a chat, only the new messages (it is uploaded in the background, see shared.chat_records)."""
+    init_upload_queue().enqueue(f"{BASE_PATH_STORAGE}/chat/{turn_blob_name(chat)}", json.dumps(chat).encode("utf-8"))
@@ -1,6 +1,14 @@
 import streamlit as st
-from helpers_webapp import BUILD_TAG, ENVIRONMENT, init_app, set_styling
-from PIL import Image
+from helpers_webapp import (
+    BUILD_TAG,
+    ENVIRONMENT,
+    IMG_SIDEBAR,
+    init_answer_cache,
+    init_app,
+    init_query_embedding_cache,
+    set_styling,
+    static_file,
+)
 
 CHANGELOG_LINES_TO_SKIP = 3
 DISPLAY_LATEST = 1
@@ -10,7 +18,7 @@ set_styling()
 init_app()
 
 with st.sidebar:
-    st.image(Image.open("./src/webapp/img/ALG_RGB_Robothuis.png"))
+    st.image(static_file(IMG_SIDEBAR))
 
 st.write("# Over Ally")
 
@@ -42,6 +50,16 @@ show_changelog()
 
 st.markdown(f"Omgeving: '{ENVIRONMENT}', Docker-build-tag: '{BUILD_TAG}'")
 st.markdown(f"De versie van de kennisbank is: `{FAISS_VERSION}`")
+cache_stats = init_query_embedding_cache().stats()
+st.markdown(
+    f"Cache van vraag-embeddings: {cache_stats['lookups']} vragen, hit rate {cache_stats['hit_rate']:.0%} "
+    f"({cache_stats['memory_hits']} uit geheugen, {cache_stats['disk_hits']} van schijf)"
+)
+answer_cache_stats = init_answer_cache().stats()
+st.markdown(
+    f"Cache van antwoorden op eerste vragen: {answer_cache_stats['lookups']} vragen, hit rate "
+    f"{answer_cache_stats['hit_rate']:.0%} ({answer_cache_stats['similar_hits']} via een vrijwel gelijke vraag)"
+)
 
 # Guard rails
 
@@ -1,63 +1,28 @@
 """Statistics are present on the datalake, they are stored as a separate .json file for each chat.
 
-When the statistics page is loaded, we check if there is a local statistics file present for the current date:
-- If there is no statistics file present, a new one will be created.
-- If there already is a statistics file present,
-  it will retrieve only new statistics (up to yesterday) and append these to the existing file.
+Every day the reporting job (src/scheduled_runs/publish_usage_statistics.py) adds the new chats to a small table on the
+datalake with per day the number of messages, users and sessions. This page only reads that table, so it loads equally
+fast however many months of chats there are.
 
-Once the statistics are present/updated, they are loaded and aggregated by date.
 The aggregated data is visualized.
 """
-import os
-from datetime import datetime
-
 import pandas as pd
 import streamlit as st
-from helpers_webapp import init_app, set_styling, update_usage_statistics
+from helpers_webapp import init_app, load_usage_aggregates, set_styling
+
+from shared.usage_aggregates import union_ids
 
 set_styling()
 init_app()
 
 st.markdown("# Statistieken")
 
+aggregates = load_usage_aggregates()
+if aggregates.empty:
+    st.write("Er zijn nog geen statistieken beschikbaar.")
+    st.stop()
 
-stats_updating_placeholder = st.empty()
-
-
-def stats_are_up_to_date():
-    """Checks if the usage_statistics file has the most recent data."""
-    if os.path.exists("data/usage_statistics"):
-        files = [
-            f for f in os.listdir("data/usage_statistics/") if os.path.isfile(os.path.join("data/usage_statistics/", f))
-        ]
-        for file in files:
-            date_last_update = datetime.strptime(file.split("_")[0], "%Y%m%d")
-            if (datetime.now().date()) == date_last_update.date():
-                return True
-        return False
-    else:
-        return False
-
-
-def load_stats() -> pd.DataFrame | None:
-    """Loads the most recent usage statistics file."""
-    print("Loading stats...")
-    if os.path.exists("data/usage_statistics"):
-        files = [
-            f for f in os.listdir("data/usage_statistics/") if os.path.isfile(os.path.join("data/usage_statistics/", f))
-        ]
-        for file in files:
-            df = pd.read_parquet(os.path.join("data/usage_statistics/", file))
-            return df
-
-
-if "stats" not in st.session_state:
-    if not stats_are_up_to_date():
-        with stats_updating_placeholder.container():
-            with st.spinner("Statistieken worden bijgewerkt, dit kan enkele ogenblikken duren..."):
-                update_usage_statistics()
-    st.session_state["stats"] = load_stats()
-    st.session_state["stats"]["timestamp_last_chat"] = pd.to_datetime(st.session_state["stats"]["timestamp_last_chat"])
+aggregates["date"] = pd.to_datetime(aggregates["date"]).dt.date
 
 if "from_date" not in st.session_state:
     st.session_state["from_date"] = None
@@ -65,62 +30,31 @@ if "from_date" not in st.session_state:
 if "to_date" not in st.session_state:
     st.session_state["to_date"] = None
 
+# First and last date in data
+st.session_state["first_date"] = aggregates["date"].min()
+st.session_state["last_date"] = aggregates["date"].max()
 
-# Aggregate data by day, for each day show the num_rows, unique num_user
-if not st.session_state["stats"].empty:
-
-    # Extract date from timestamp
-    st.session_state["stats"]["date"] = pd.to_datetime(st.session_state["stats"]["timestamp_last_chat"]).dt.date
-
-    # First and last date in data
-    st.session_state["first_date"] = st.session_state["stats"]["date"].min()
-    st.session_state["last_date"] = st.session_state["stats"]["date"].max()
-
-    # Aggregate per day
-    st.session_state.agg_df = (
-        st.session_state["stats"]
-        .groupby("date")
-        .agg(
-            Gebruikers=("hashed_user", "nunique"),
-            Berichten=("timestamp_last_chat", "count"),
-        )
-        .reset_index()
-    )
+# Filter based on selected date range
+if st.session_state["from_date"] is not None:
+    aggregates = aggregates[aggregates["date"] >= st.session_state["from_date"]]
 
-    # Set date as index for plotting
-    st.session_state["agg_df"].set_index("date", inplace=True)
+if st.session_state["to_date"] is not None:
+    aggregates = aggregates[aggregates["date"] <= st.session_state["to_date"]]
 
-    stats_time_filtered = st.session_state["stats"]
-
-    # Filter user metrics based on selected date range
-    if st.session_state["from_date"] is not None:
-        st.session_state["agg_df"] = st.session_state.agg_df[
-            st.session_state.agg_df.index >= st.session_state.from_date
-        ]
-
-    if st.session_state["to_date"] is not None:
-        st.session_state["agg_df"] = st.session_state.agg_df[st.session_state.agg_df.index <= st.session_state.to_date]
-
-    if st.session_state["from_date"] is not None and st.session_state["to_date"] is not None:
-        stats_time_filtered = st.session_state["stats"][
-            (st.session_state["stats"]["timestamp_last_chat"].dt.date <= st.session_state["to_date"])
-            & (st.session_state["stats"]["timestamp_last_chat"].dt.date >= st.session_state["from_date"])
-        ]
-        unique_users_over_time = stats_time_filtered["hashed_user"].nunique()
-        st.session_state.unique_users_over_time = unique_users_over_time
-    else:
-        unique_users_over_time = st.session_state["stats"]["hashed_user"].nunique()
-        st.session_state.unique_users_over_time = unique_users_over_time
+# Show line chart, for each day the number of unique users and messages
+agg_df = aggregates.set_index("date")[["users", "messages"]].rename(
+    columns={"users": "Gebruikers", "messages": "Berichten"}
+)
+st.line_chart(data=agg_df, color=[(13, 93, 191, 0.7), (253, 46, 48, 0.7)])
 
-    # Show line chart
-    st.line_chart(data=st.session_state["agg_df"], color=[(13, 93, 191, 0.7), (253, 46, 48, 0.7)])
+# Show overall stats, users and sessions that are active on several days count once
+col1_metric, col2_metric, col3_metric = st.columns(3)
 
-    # Show overall stats
-    col1_metric, col2_metric = st.columns(2)
+col1_metric.metric(label="Berichten", value=int(aggregates["messages"].sum()))
 
-    col1_metric.metric(label="Berichten", value=st.session_state["agg_df"]["Berichten"].sum())
+col2_metric.metric(label="Gebruikers", value=union_ids(aggregates["user_ids"]).count())
 
-    col2_metric.metric(label="Gebruikers", value=st.session_state.unique_users_over_time)
+col3_metric.metric(label="Sessies", value=union_ids(aggregates["session_ids"]).count())
 
 
 col1_date, col2_date = st.columns(2)
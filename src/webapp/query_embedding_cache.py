@@ -0,0 +1,183 @@
+"""Cache of query embeddings for the chat path.
+
+Every question (and every condensed follow-up question) is embedded before the faiss search. Agents ask the same
+questions over and over, so the embeddings are kept in a process-wide LRU cache, optionally backed by a SQLite file
+that survives restarts and is shared by the processes on a host. The key is the model and the normalized query. When
+the SQLite file grows beyond max_disk_mb, the least recently used embeddings are evicted from it.
+"""
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+MAX_MEMORY_ENTRIES = 10_000
+MAX_DISK_SIZE_MB = 200
+EVICT_EVERY = 100  # puts
+LOG_STATS_EVERY = 100  # lookups
+
+_shared_caches = {}
+_shared_caches_lock = threading.Lock()
+
+
+def normalize_query(text: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation, so trivially different questions share a key."""
+    return re.sub(r"\s+", " ", text).strip().lower().rstrip("?!. ")
+
+
+class QueryEmbeddingCache:
+    """Thread-safe LRU cache of query embeddings with an optional SQLite file behind it."""
+
+    def __init__(
+        self,
+        model: str,
+        max_entries: int = MAX_MEMORY_ENTRIES,
+        path: str | Path | None = None,
+        max_disk_mb: int = MAX_DISK_SIZE_MB,
+    ):
+        """Create the cache; without a path the embeddings are only kept in memory."""
+        self.model = model
+        self.max_entries = max_entries
+        self.max_disk_bytes = max_disk_mb * 1024 * 1024
+        self.nr_puts = 0
+        self.entries: OrderedDict[str, list[float]] = OrderedDict()
+        self.lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.logger = logging.getLogger("KS-FAQ")
+        self.conn = None
+        if path is not None:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            self.conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings "
+                "(key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_query_last_used ON query_embeddings (last_used)")
+            self.conn.commit()
+
+    def key(self, text: str) -> str:
+        """Hash of model and normalized query."""
+        return hashlib.sha256(f"{self.model}\n{normalize_query(text)}".encode("utf-8")).hexdigest()
+
+    def get(self, text: str) -> list[float] | None:
+        """Embedding of the query, from memory or from disk; None when it is not cached."""
+        key = self.key(text)
+        with self.lock:
+            vector = self.entries.get(key)
+            if vector is not None:
+                self.entries.move_to_end(key)
+                self.memory_hits += 1
+            elif self.conn is not None:
+                row = self.conn.execute("SELECT vector FROM query_embeddings WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    vector = np.frombuffer(row[0], dtype=np.float32).tolist()
+                    self._remember(key, vector)
+                    self.disk_hits += 1
+                    self.conn.execute("UPDATE query_embeddings SET last_used = ? WHERE key = ?", (time.time(), key))
+                    self.conn.commit()
+            if vector is None:
+                self.misses += 1
+            if self.lookups % LOG_STATS_EVERY == 0:
+                self.logger.info(f"Query embedding cache: {self.stats()}")
+        return vector
+
+    def put(self, text: str, vector: list[float]) -> None:
+        """Store the embedding of a query."""
+        key = self.key(text)
+        with self.lock:
+            self._remember(key, vector)
+            if self.conn is not None:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO query_embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                    (key, np.asarray(vector, dtype=np.float32).tobytes(), time.time()),
+                )
+                self.conn.commit()
+                self.nr_puts += 1
+                if self.nr_puts % EVICT_EVERY == 0:
+                    self._evict()
+
+    def _evict(self) -> int:
+        """Remove the least recently used embeddings from disk until the file fits within max_disk_mb."""
+        cursor = self.conn.execute(
+            """
+            DELETE FROM query_embeddings WHERE key IN (
+                SELECT key FROM (
+                    SELECT key, SUM(LENGTH(vector)) OVER (ORDER BY last_used DESC, key) AS cumulative_size
+                    FROM query_embeddings
+                )
+                WHERE cumulative_size > ?
+            )
+            """,
+            (self.max_disk_bytes,),
+        )
+        self.conn.commit()
+        if cursor.rowcount > 0:
+            self.logger.info(f"Evicted {cursor.rowcount} query embeddings from disk.")
+        return cursor.rowcount
+
+    def _remember(self, key: str, vector: list[float]) -> None:
+        self.entries[key] = vector
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    @property
+    def lookups(self) -> int:
+        """Number of lookups so far."""
+        return self.memory_hits + self.disk_hits + self.misses
+
+    def stats(self) -> dict:
+        """Hit-rate metrics of the cache."""
+        hits = self.memory_hits + self.disk_hits
+        return {
+            "lookups": self.lookups,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / self.lookups, 3) if self.lookups else 0.0,
+            "entries": len(self.entries),
+        }
+
+
+def shared_query_embedding_cache(
+    model: str, max_entries: int = MAX_MEMORY_ENTRIES, path: str | Path | None = None
+) -> "QueryEmbeddingCache":
+    """The process-wide cache for these settings.
+
+    This is not an st.cache_resource, because the pages import helpers_webapp under another module name than the main
+    page does, and would get a cache of their own.
+    """
+    with _shared_caches_lock:
+        key = (model, max_entries, str(path))
+        if key not in _shared_caches:
+            _shared_caches[key] = QueryEmbeddingCache(model, max_entries=max_entries, path=path)
+        return _shared_caches[key]
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """Embeddings of which the queries are looked up in a QueryEmbeddingCache first."""
+
+    def __init__(self, underlying: Embeddings, cache: QueryEmbeddingCache):
+        """Wrap the underlying embeddings with the cache."""
+        self.underlying = underlying
+        self.cache = cache
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        """Embed documents (not cached, the webapp doesn't embed documents)."""
+        return self.underlying.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        """Embed a query, or take its embedding from the cache."""
+        vector = self.cache.get(text)
+        if vector is None:
+            vector = self.underlying.embed_query(text)
+            self.cache.put(text, vector)
+        return vector
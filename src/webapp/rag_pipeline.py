@@ -0,0 +1,185 @@
+"""Parts of the faster RAG pipeline: condensing questions, latency per stage and streaming the answer.
+
+ConversationalRetrievalChain rewrites every follow-up question into a standalone question with an LLM call before it
+searches the faiss index. Follow-up questions that already are standalone skip that call, the others are condensed by
+a small, fast model.
+"""
+import re
+import time
+from typing import Any
+from uuid import UUID
+
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.callbacks.manager import CallbackManagerForChainRun
+from langchain.chains import LLMChain
+
+MIN_WORDS_SELF_CONTAINED = 5
+# Words that (mostly) refer back to something earlier in the conversation
+REFERRING_WORDS = {
+    "dit",
+    "dat",
+    "deze",
+    "die",
+    "daar",
+    "daarvan",
+    "daarover",
+    "daarmee",
+    "daarvoor",
+    "daarna",
+    "hier",
+    "hiervan",
+    "hierover",
+    "hiermee",
+    "hiervoor",
+    "ervan",
+    "erover",
+    "ermee",
+    "ervoor",
+    "hij",
+    "zij",
+    "ze",
+    "hem",
+    "haar",
+    "hun",
+    "zo'n",
+    "zelfde",
+    "vorige",
+    "bovenstaande",
+}
+CONTINUATION_STARTS = ("en ", "maar ", "ook ", "of ", "dus ", "wat als ", "en als ", "en wat ", "waarom niet")
+
+STAGE_CONDENSE = "condense"
+STAGE_RETRIEVE = "retrieve"
+STAGE_ANSWER = "answer"
+
+
+def is_self_contained(question: str) -> bool:
+    """Cheap check whether a follow-up question can be understood without the chat history.
+
+    When in doubt the question is not self-contained, it then is condensed as before.
+    """
+    normalized = re.sub(r"\s+", " ", question).strip().lower()
+    words = re.findall(r"[\w']+", normalized)
+    if len(words) < MIN_WORDS_SELF_CONTAINED or normalized.startswith(CONTINUATION_STARTS):
+        return False
+    return not any(word in REFERRING_WORDS for word in words)
+
+
+class CondenseQuestionChain(LLMChain):
+    """Condense-question step that returns self-contained questions as they are, without calling the LLM."""
+
+    def _call(self, inputs: dict[str, Any], run_manager: CallbackManagerForChainRun | None = None) -> dict[str, str]:
+        if is_self_contained(inputs["question"]):
+            return {self.output_key: inputs["question"]}
+        return super()._call(inputs, run_manager=run_manager)
+
+
+class StageLatencyHandler(BaseCallbackHandler):
+    """Measures the time (in seconds) the tagged stages of a chain (condense, retrieve, answer) take."""
+
+    def __init__(self):
+        """Start without timings."""
+        self.timings: dict[str, float] = {}
+        self.running: dict[UUID, tuple[str, float]] = {}
+
+    def _start(self, run_id: UUID, tags: list[str] | None) -> None:
+        for stage in [STAGE_CONDENSE, STAGE_RETRIEVE, STAGE_ANSWER]:
+            # Tags given to a chain or retriever are not inherited by its nested runs, so only the run a stage is
+            # tagged on is timed
+            if stage in (tags or []):
+                self.running[run_id] = (stage, time.perf_counter())
+
+    def _end(self, run_id: UUID) -> None:
+        if run_id in self.running:
+            stage, start = self.running.pop(run_id)
+            self.timings[stage] = self.timings.get(stage, 0.0) + time.perf_counter() - start
+
+    def on_chain_start(self, serialized: dict, inputs: dict, *, run_id: UUID, tags: list[str] | None = None, **kwargs):
+        """Start timing a chain of a stage."""
+        self._start(run_id, tags)
+
+    def on_chain_end(self, outputs: dict, *, run_id: UUID, **kwargs):
+        """Stop timing a chain of a stage."""
+        self._end(run_id)
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID, **kwargs):
+        """Stop timing a failed chain."""
+        self._end(run_id)
+
+    def on_retriever_start(
+        self, serialized: dict, query: str, *, run_id: UUID, tags: list[str] | None = None, **kwargs
+    ):
+        """Start timing the retriever."""
+        self._start(run_id, tags)
+
+    def on_retriever_end(self, documents, *, run_id: UUID, **kwargs):
+        """Stop timing the retriever."""
+        self._end(run_id)
+
+    def on_retriever_error(self, error: BaseException, *, run_id: UUID, **kwargs):
+        """Stop timing a failed retriever."""
+        self._end(run_id)
+
+
+class StreamingAnswerHandler(BaseCallbackHandler):
+    """Writes the tokens of the answer (not those of the condensed question) to a placeholder as they arrive.
+
+    The answer stage is tagged on the chain that combines the documents; tags given to a chain are not inherited by its
+    nested runs, so its LLM runs are recognized by their parent run.
+    """
+
+    def __init__(self, placeholder: Any, cursor: str = "▌"):
+        """Stream into the placeholder (a Streamlit st.empty()); the cursor is shown after the text while streaming."""
+        self.placeholder = placeholder
+        self.cursor = cursor
+        self.text = ""
+        self.answer_runs: set[UUID] = set()
+
+    def _register(self, run_id: UUID, parent_run_id: UUID | None, tags: list[str] | None) -> None:
+        if STAGE_ANSWER in (tags or []) or parent_run_id in self.answer_runs:
+            self.answer_runs.add(run_id)
+
+    def on_chain_start(
+        self,
+        serialized: dict,
+        inputs: dict,
+        *,
+        run_id: UUID,
+        parent_run_id: UUID | None = None,
+        tags: list[str] | None = None,
+        **kwargs,
+    ):
+        """Remember the runs of the answer stage."""
+        self._register(run_id, parent_run_id, tags)
+
+    def on_llm_start(
+        self,
+        serialized: dict,
+        prompts: list[str],
+        *,
+        run_id: UUID,
+        parent_run_id: UUID | None = None,
+        tags: list[str] | None = None,
+        **kwargs,
+    ):
+        """Remember the LLM runs of the answer stage."""
+        self._register(run_id, parent_run_id, tags)
+
+    def on_chat_model_start(
+        self,
+        serialized: dict,
+        messages: list,
+        *,
+        run_id: UUID,
+        parent_run_id: UUID | None = None,
+        tags: list[str] | None = None,
+        **kwargs,
+    ):
+        """Remember the chat model runs of the answer stage."""
+        self._register(run_id, parent_run_id, tags)
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs):
+        """Show the answer so far."""
+        if run_id in self.answer_runs:
+            self.text += token
+            self.placeholder.markdown(self.text + self.cursor)
@@ -0,0 +1,180 @@
+"""Background upload of chats and feedback to the datalake.
+
+The UI only puts a blob on a bounded in-process queue. A worker thread takes the blobs off the queue in batches and
+uploads them (a batch in parallel), with retries. Blobs that can't be uploaded, or don't fit on the queue, are written
+to a local spill-over directory and retried later, so a storage hiccup never reaches the user. Blobs that are still on
+the queue when the process exits are spilled as well.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable
+from urllib.parse import quote, unquote
+
+from azure.storage.blob import ContainerClient
+
+MAX_QUEUE_SIZE = 1000
+BATCH_SIZE = 16
+UPLOAD_CONCURRENCY = 4
+MAX_RETRIES = 4
+RETRY_SPILLED_SECONDS = 60
+FLUSH_TIMEOUT_SECONDS = 10
+
+_shared_queues = {}
+_shared_queues_lock = threading.Lock()
+
+
+class UploadQueue:
+    """Bounded queue of (blob name, data) with a worker thread that uploads them."""
+
+    def __init__(
+        self,
+        client_factory: Callable[[], ContainerClient],
+        spill_dir: str | Path,
+        max_queue_size: int = MAX_QUEUE_SIZE,
+        batch_size: int = BATCH_SIZE,
+        max_retries: int = MAX_RETRIES,
+    ):
+        """Create the queue and start the worker thread; client_factory creates the container client to upload with."""
+        self.client_factory = client_factory
+        self.client = None
+        self.spill_dir = Path(spill_dir)
+        self.spill_dir.mkdir(parents=True, exist_ok=True)
+        self.queue: queue.Queue[tuple[str, bytes]] = queue.Queue(maxsize=max_queue_size)
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.uploaded = 0
+        self.spilled = 0
+        self.in_flight: list[tuple[str, bytes]] = []  # the batch the worker is uploading
+        self.logger = logging.getLogger("KS-FAQ")
+        self.executor = ThreadPoolExecutor(max_workers=UPLOAD_CONCURRENCY, thread_name_prefix="upload")
+        self.thread = threading.Thread(target=self._work, name="upload-queue", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def enqueue(self, blob_name: str, data: bytes) -> None:
+        """Schedule a blob for upload; never blocks (a full queue spills to disk)."""
+        try:
+            self.queue.put_nowait((blob_name, data))
+        except queue.Full:
+            self.logger.warning(f"Upload queue is full, spilling {blob_name} to disk.")
+            self._spill(blob_name, data)
+
+    def flush(self, timeout: float = FLUSH_TIMEOUT_SECONDS) -> bool:
+        """Wait until the queue is empty (at most timeout seconds); returns whether it is."""
+        deadline = time.monotonic() + timeout
+        while self.queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return self.queue.unfinished_tasks == 0
+
+    def close(self, timeout: float = FLUSH_TIMEOUT_SECONDS) -> None:
+        """Upload what is queued (at most timeout seconds) and spill the rest to disk, before the process exits."""
+        if self.flush(timeout):
+            return
+        remaining = list(self.in_flight)  # may be uploaded twice, the uploads overwrite
+        while True:
+            try:
+                remaining.append(self.queue.get_nowait())
+                self.queue.task_done()
+            except queue.Empty:
+                break
+        self.logger.warning(f"Spilling {len(remaining)} blobs that weren't uploaded before exit to disk.")
+        for blob_name, data in remaining:
+            self._spill(blob_name, data)
+
+    def stats(self) -> dict:
+        """Numbers of uploaded, queued and spilled blobs."""
+        return {
+            "uploaded": self.uploaded,
+            "queued": self.queue.qsize(),
+            "spilled": self.spilled,
+            "waiting_on_disk": len(self._spilled_paths()),
+        }
+
+    def _work(self) -> None:
+        """Upload batches from the queue; when idle, retry the blobs on disk every RETRY_SPILLED_SECONDS."""
+        last_spill_retry = time.monotonic()
+        while True:
+            try:
+                batch = [self.queue.get(timeout=RETRY_SPILLED_SECONDS)]
+            except queue.Empty:
+                batch = []
+            while batch and len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if batch:
+                self.in_flight = batch
+                try:
+                    results = list(self.executor.map(self._upload_with_retries, batch))
+                except RuntimeError:  # the executor is shut down when the interpreter exits, upload in this thread
+                    results = [self._upload_with_retries(item) for item in batch]
+                for (blob_name, data), uploaded in zip(batch, results):
+                    if not uploaded:
+                        self._spill(blob_name, data)
+                    self.queue.task_done()
+                self.in_flight = []
+            if time.monotonic() - last_spill_retry >= RETRY_SPILLED_SECONDS:
+                self._retry_spilled()
+                last_spill_retry = time.monotonic()
+
+    def _upload_with_retries(self, item: tuple[str, bytes]) -> bool:
+        """Upload a blob, with exponential backoff; returns whether it succeeded."""
+        blob_name, data = item
+        for attempt in range(self.max_retries):
+            try:
+                if self.client is None:
+                    self.client = self.client_factory()
+                self.client.upload_blob(name=blob_name, data=data, overwrite=True)
+                self.uploaded += 1
+                return True
+            except Exception as e:
+                self.logger.warning(f"Uploading {blob_name} failed (attempt {attempt + 1}): {repr(e)}")
+                if attempt < self.max_retries - 1:
+                    time.sleep(2**attempt)
+        return False
+
+    def _spill(self, blob_name: str, data: bytes) -> None:
+        """Keep a blob on local disk, to upload it later.
+
+        The blob is written to a temporary file (starting with a dot) that is renamed when complete, so a partial file
+        is never uploaded.
+        """
+        tmp_path = self.spill_dir / f".{uuid.uuid4().hex}.tmp"
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, self.spill_dir / quote(blob_name, safe=""))
+        self.spilled += 1
+
+    def _spilled_paths(self) -> list[Path]:
+        """The blobs on disk, without the temporary files that are being written."""
+        return sorted(path for path in self.spill_dir.iterdir() if not path.name.startswith("."))
+
+    def _retry_spilled(self) -> None:
+        """Upload the blobs on disk (one attempt each, they stay on disk when it fails)."""
+        for path in self._spilled_paths():
+            try:
+                if self.client is None:
+                    self.client = self.client_factory()
+                self.client.upload_blob(name=unquote(path.name), data=path.read_bytes(), overwrite=True)
+                path.unlink()
+                self.uploaded += 1
+            except Exception as e:
+                self.logger.warning(f"Uploading spilled blob {unquote(path.name)} failed: {repr(e)}")
+                return
+
+
+def shared_upload_queue(client_factory: Callable[[], ContainerClient], spill_dir: str | Path) -> UploadQueue:
+    """The process-wide upload queue for a spill-over directory (see shared_query_embedding_cache)."""
+    with _shared_queues_lock:
+        key = str(spill_dir)
+        if key not in _shared_queues:
+            _shared_queues[key] = UploadQueue(client_factory, spill_dir)
+        return _shared_queues[key]
@@ -0,0 +1,42 @@
+"""Tests of the cache of answers to first questions."""
+import math
+
+from webapp.answer_cache import AnswerCache
+
+VERSION = "2025-01-01_1200"
+K = 4
+
+
+def embedding_with_similarity(similarity: float) -> list[float]:
+    """Embedding of which the cosine similarity with [1, 0] is similarity."""
+    return [similarity, math.sqrt(1 - similarity**2)]
+
+
+def cache_with_answer(similarity_threshold: float) -> AnswerCache:
+    cache = AnswerCache(similarity_threshold=similarity_threshold)
+    cache.set_current_version(VERSION)
+    cache.put(VERSION, K, "Hoe wijzig ik mijn IBAN?", [1.0, 0.0], "Via Mijn omgeving.", [])
+    return cache
+
+
+def test_question_just_below_threshold_gets_no_answer():
+    cache = cache_with_answer(similarity_threshold=0.97)
+    assert cache.get(VERSION, K, "Hoe wijzig ik mijn adres?", embedding_with_similarity(0.969)) is None
+
+
+def test_question_above_threshold_shares_the_answer():
+    cache = cache_with_answer(similarity_threshold=0.97)
+    cached = cache.get(VERSION, K, "Hoe verander ik mijn IBAN?", embedding_with_similarity(0.971))
+    assert cached is not None and cached.answer == "Via Mijn omgeving."
+
+
+def test_by_default_only_the_same_question_shares_the_answer():
+    cache = cache_with_answer(similarity_threshold=AnswerCache().similarity_threshold)
+    assert cache.get(VERSION, K, "Hoe verander ik mijn IBAN?", [1.0, 0.0]) is None
+    assert cache.get(VERSION, K, "hoe wijzig ik mijn IBAN", [0.0, 1.0]) is not None
+
+
+def test_answers_of_another_faiss_version_are_dropped():
+    cache = cache_with_answer(similarity_threshold=1.0)
+    cache.set_current_version("2025-02-01_1200")
+    assert cache.get(VERSION, K, "Hoe wijzig ik mijn IBAN?", [1.0, 0.0]) is None
@@ -0,0 +1,76 @@
+"""Tests of rebuilding the conversations from the chat records."""
+from shared.chat_records import (
+    full_conversations,
+    reconstruct_conversations,
+    turn_blob_name,
+)
+
+SESSION = "20251113093000-abc"
+
+
+def message(role: str, content: str) -> dict:
+    return {"role": role, "content": content}
+
+
+def turn(conversation_nr: int, turn_nr: int, time: str, messages: list[dict], **fields) -> dict:
+    return {
+        "session_uuid": SESSION,
+        "timestamp_last_chat": f"2025-11-13 {time}",
+        "hashed_user": "user",
+        "conversation_nr": conversation_nr,
+        "turn": turn_nr,
+        "messages": messages,
+        **fields,
+    }
+
+
+def snapshot(time: str, messages: list[dict]) -> dict:
+    return {"session_uuid": SESSION, "timestamp_last_chat": f"2025-11-13 {time}", "conversation": messages}
+
+
+def test_turns_are_merged_per_conversation_in_order():
+    first = [message("human", "Hoe wijzig ik mijn IBAN?"), message("ai", "Via Mijn omgeving.")]
+    second = [message("human", "En mijn adres?"), message("ai", "Ook via Mijn omgeving.")]
+    other = [message("human", "Wat is Ally?"), message("ai", "Een chatbot.")]
+    records = [
+        turn(1, 2, "09:32:00", second, faiss_version="v2"),
+        turn(2, 1, "09:40:00", other, faiss_version="v2"),
+        turn(1, 1, "09:31:00", first, faiss_version="v1"),
+    ]
+
+    conversations = reconstruct_conversations(records)
+
+    assert [conversation["conversation"] for conversation in conversations] == [first + second, other]
+    # the fields of the last turn, without those of the turn records
+    assert conversations[0]["timestamp_last_chat"] == "2025-11-13 09:32:00"
+    assert conversations[0]["faiss_version"] == "v2"
+    assert not {"conversation_nr", "turn", "messages"} & set(conversations[0])
+
+
+def test_snapshots_are_passed_on_and_sorted_with_the_turns():
+    old = snapshot("08:00:00", [message("human", "Hallo?"), message("ai", "Hallo!")])
+    new = turn(1, 1, "07:00:00", [message("human", "Goedemorgen"), message("ai", "Goedemorgen!")])
+
+    assert reconstruct_conversations([old, new]) == [
+        {key: value for key, value in new.items() if key not in ("conversation_nr", "turn", "messages")}
+        | {"conversation": new["messages"]},
+        old,
+    ]
+
+
+def test_only_the_last_snapshot_of_a_conversation_is_full():
+    question = message("human", "Hoe wijzig ik mijn IBAN?")
+    answer = message("ai", "Via Mijn omgeving.")
+    follow_up = message("human", "Dank je!")
+    snapshots = [
+        snapshot("09:31:00", [question, answer]),
+        snapshot("09:32:00", [question, answer, follow_up]),
+        snapshot("09:33:00", [message("human", "Andere vraag")]),
+    ]
+
+    assert full_conversations(snapshots) == snapshots[1:]
+
+
+def test_turn_blob_name_has_the_time_conversation_and_turn():
+    record = turn(2, 3, "09:32:05", [])
+    assert turn_blob_name(record) == f"{SESSION}_093205_2-3.json"
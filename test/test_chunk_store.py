@@ -0,0 +1,54 @@
+"""Tests of saving a FAISS index with its chunk store and loading it back."""
+import pytest
+from langchain_community.embeddings import DeterministicFakeEmbedding
+from langchain_community.vectorstores import FAISS
+
+from shared.chunk_store import (
+    MmapChunkStore,
+    load_faiss,
+    load_faiss_in_memory,
+    save_faiss,
+)
+
+TEXTS = ["Je IBAN wijzig je in Mijn omgeving.", "Een adreswijziging geef je door.", "Ü, é en € blijven heel."]
+IDS = ["1_0", "2_0", "3_0"]
+
+
+@pytest.fixture
+def faiss_db():
+    metadatas = [{"id": int(chunk_id.split("_")[0]), "source": f"Artikel {chunk_id}"} for chunk_id in IDS]
+    return FAISS.from_texts(TEXTS, DeterministicFakeEmbedding(size=16), metadatas=metadatas, ids=IDS)
+
+
+def test_loaded_read_only_index_finds_the_same_chunks(faiss_db, tmp_path):
+    save_faiss(faiss_db, tmp_path)
+    loaded = load_faiss(str(tmp_path), "index", faiss_db.embedding_function)
+
+    for text in TEXTS:
+        expected = faiss_db.similarity_search_with_score(text, k=2)
+        found = loaded.similarity_search_with_score(text, k=2)
+        assert [(doc.page_content, doc.metadata) for doc, _ in found] == [
+            (doc.page_content, doc.metadata) for doc, _ in expected
+        ]
+        assert [score for _, score in found] == pytest.approx([score for _, score in expected])
+
+
+def test_loaded_in_memory_index_keeps_the_chunk_ids(faiss_db, tmp_path):
+    save_faiss(faiss_db, tmp_path)
+    loaded = load_faiss_in_memory(str(tmp_path), "index", faiss_db.embedding_function)
+
+    assert loaded.index_to_docstore_id == faiss_db.index_to_docstore_id
+    assert [loaded.docstore.search(chunk_id).page_content for chunk_id in IDS] == TEXTS
+
+    # chunks can be deleted and added, as in the incremental update of the index
+    loaded.delete(["2_0"])
+    loaded.add_texts(["Nieuw."], metadatas=[{"id": 4, "source": "Artikel 4_0"}], ids=["4_0"])
+    assert sorted(loaded.index_to_docstore_id.values()) == ["1_0", "3_0", "4_0"]
+    assert loaded.index.ntotal == 3
+
+
+def test_other_files_are_not_read_as_chunk_store(tmp_path):
+    path = tmp_path / "index.pkl"
+    path.write_bytes(b"not a chunk store")
+    with pytest.raises(ValueError):
+        MmapChunkStore(path)
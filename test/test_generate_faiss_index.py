@@ -0,0 +1,145 @@
+"""Tests of the incremental update of the FAISS index: changed articles are re-embedded, removed ones deleted."""
+import datetime
+import os
+from types import SimpleNamespace
+
+import pytest
+from langchain.docstore.document import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_community.embeddings import DeterministicFakeEmbedding
+
+os.environ.setdefault("OPENAI_API_KEY", "mock")
+os.environ.setdefault("OPENAI_ENDPOINT", "http://localhost")
+os.environ.setdefault("HELPJUICE_API_KEY", "mock")
+os.environ.setdefault("HELPJUICE_API_URL", "http://localhost")
+
+from scheduled_runs.my_faiss import generate_faiss_index  # noqa: E402
+from scheduled_runs.my_faiss.generate_faiss_index import (  # noqa: E402
+    LOCAL_NAME_SUBFOLDER_FAISS_INDEX,
+    CreateFAISSIndex,
+)
+from scheduled_runs.my_faiss.get_articles import ArticleWatermark  # noqa: E402
+from scheduled_runs.my_faiss.index_manifest import IndexManifest  # noqa: E402
+from shared.chunk_store import load_faiss_in_memory  # noqa: E402
+
+UPDATED_AT = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+class CountingEmbeddings(DeterministicFakeEmbedding):
+    """Fake embeddings that remember which texts were embedded."""
+
+    embedded: list[str] = []
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.embedded.extend(texts)
+        return super().embed_documents(texts)
+
+
+def article(article_id: int, body: str, date: str = "2025-01-01") -> Document:
+    metadata = {"id": article_id, "source": f"Artikel {article_id}", "url": f"https://helpjuice/{article_id}"}
+    return Document(page_content=body, metadata={**metadata, "date": date})
+
+
+def sync_of(article_ids: list[int]) -> SimpleNamespace:
+    """Stand-in for ArticleSync after a sync that listed these articles."""
+    return SimpleNamespace(
+        listing={article_id: UPDATED_AT for article_id in article_ids},
+        watermark=ArticleWatermark(max_updated_at=UPDATED_AT, article_ids=article_ids),
+    )
+
+
+def manifest() -> IndexManifest:
+    return IndexManifest(embeddings_model="fake", chunk_size=40, chunk_overlap=0)
+
+
+@pytest.fixture
+def creator(monkeypatch, tmp_path):
+    """CreateFAISSIndex with fake embeddings and a character splitter, working in a temporary folder."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(
+        generate_faiss_index,
+        "TokenTextSplitter",
+        lambda encoding_name, chunk_size, chunk_overlap: RecursiveCharacterTextSplitter(chunk_size=40, chunk_overlap=0),
+    )
+    creator = CreateFAISSIndex(incremental=True)
+    creator.embeddings = CountingEmbeddings(size=16, embedded=[])
+    return creator
+
+
+def build_first_index(creator: CreateFAISSIndex, docs: list[Document]) -> None:
+    creator._load_previous_vectorstore = lambda manifest: None
+    sync = sync_of([doc.metadata["id"] for doc in docs])
+    sync.watermark.max_updated_at = None
+    assert creator._generate_embeddings_and_vectorstore(manifest(), docs, sync)
+
+
+def load_previous_from_disk(creator: CreateFAISSIndex) -> None:
+    """Make the next build start from the index that was saved by the previous one."""
+    folder = LOCAL_NAME_SUBFOLDER_FAISS_INDEX
+    previous = (
+        load_faiss_in_memory(folder, "index", creator.embeddings),
+        IndexManifest.load(f"{folder}/index.json"),
+    )
+    creator._load_previous_vectorstore = lambda manifest: previous
+    creator.embeddings.embedded.clear()
+
+
+def chunks_per_article(creator: CreateFAISSIndex) -> dict[int, list[str]]:
+    chunks = {}
+    for chunk_id in creator.faiss_db.index_to_docstore_id.values():
+        chunk = creator.faiss_db.docstore.search(chunk_id)
+        chunks.setdefault(chunk.metadata["id"], []).append(chunk.page_content)
+    return chunks
+
+
+def test_changed_and_removed_articles_replace_their_chunks(creator):
+    build_first_index(
+        creator,
+        [
+            article(1, "Je IBAN wijzig je in Mijn omgeving. Daarna ontvang je een bevestiging per e-mail."),
+            article(2, "Een adreswijziging geef je door aan de gemeente."),
+            article(3, "Dit artikel wordt verwijderd."),
+        ],
+    )
+    load_previous_from_disk(creator)
+
+    changed = article(2, "Een verhuizing geef je door via Mijn omgeving.", date="2025-02-01")
+    new = article(4, "Een nieuw artikel.")
+    assert creator._generate_embeddings_and_vectorstore(manifest(), [changed, new], sync_of([1, 2, 4]))
+
+    chunks = chunks_per_article(creator)
+    assert sorted(chunks) == [1, 2, 4]
+    assert "verhuizing" in " ".join(chunks[2]) and "adreswijziging" not in " ".join(chunks[2])
+    # the chunks of the unchanged article are reused, not embedded again
+    assert not any("IBAN" in text for text in creator.embeddings.embedded)
+    assert creator.faiss_db.index.ntotal == sum(len(article_chunks) for article_chunks in chunks.values())
+    chunk_ids = sorted(chunk_id for entry in creator.manifest.articles.values() for chunk_id in entry.chunk_ids)
+    assert sorted(creator.faiss_db.index_to_docstore_id.values()) == chunk_ids
+    assert sorted(creator.manifest.articles) == ["1", "2", "4"]
+
+
+def test_saved_index_is_the_updated_one(creator):
+    build_first_index(creator, [article(1, "Eerste versie."), article(2, "Blijft staan.")])
+    load_previous_from_disk(creator)
+    creator._generate_embeddings_and_vectorstore(
+        manifest(), [article(1, "Tweede versie.", "2025-02-01")], sync_of([1, 2])
+    )
+
+    load_previous_from_disk(creator)
+    faiss_db, saved_manifest = creator._load_previous_vectorstore(manifest())
+    saved = sorted(
+        faiss_db.docstore.search(chunk_id).page_content for chunk_id in faiss_db.index_to_docstore_id.values()
+    )
+    assert saved == ["Titel van artikel: Artikel 1\n\nTweede versie.", "Titel van artikel: Artikel 2\n\nBlijft staan."]
+    assert saved_manifest.articles["1"].date == "2025-02-01"
+
+
+def test_unchanged_articles_leave_the_index_as_it_is(creator):
+    docs = [article(1, "Eerste artikel."), article(2, "Tweede artikel.")]
+    build_first_index(creator, docs)
+    load_previous_from_disk(creator)
+
+    # the sync gives no articles, or only articles of which the content did not change
+    assert not creator._generate_embeddings_and_vectorstore(manifest(), [], sync_of([1, 2]))
+    assert not creator._generate_embeddings_and_vectorstore(manifest(), docs[:1], sync_of([1, 2]))
+    assert creator.embeddings.embedded == []
@@ -0,0 +1,47 @@
+"""Tests of the retrieval of the Helpjuice articles against the local mock of the API."""
+import os
+
+import pytest
+
+os.environ.setdefault("HELPJUICE_API_KEY", "mock")
+os.environ.setdefault("HELPJUICE_API_URL", "http://localhost")
+
+from scheduled_runs.my_faiss import get_articles  # noqa: E402
+from scheduled_runs.my_faiss.mock_helpjuice import (  # noqa: E402
+    MAX_LIMIT,
+    MockHelpjuiceServer,
+    fake_articles,
+)
+
+NR_ARTICLES = 2500
+
+
+@pytest.fixture
+def mock_server(monkeypatch):
+    """Mock Helpjuice API on a free port, with some latency so the pages are fetched in parallel."""
+    server = MockHelpjuiceServer(0, fake_articles(NR_ARTICLES), latency=0.05)
+    server.start_in_thread()
+    monkeypatch.setattr(get_articles, "HELPJUICE_API_URL", server.url)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_every_page_is_requested_once(mock_server):
+    list(get_articles.iter_articles())
+    nr_pages = -(-NR_ARTICLES // MAX_LIMIT)
+    assert sorted(mock_server.requested_pages) == list(range(1, nr_pages + 1))
+
+
+def test_only_articles_of_klantenservice_categories(mock_server):
+    documents = list(get_articles.iter_articles())
+    # fake_articles gives every tenth article no category
+    assert all((document.metadata["id"] - 1000) % 10 != 0 for document in documents)
+    assert len(documents) == NR_ARTICLES - NR_ARTICLES // 10
+
+
+def test_parallel_pages_return_every_article_once(mock_server):
+    ids = [document.metadata["id"] for document in get_articles.iter_articles()]
+    expected = {article["id"] for article in mock_server.articles if "category" in article}
+    assert len(ids) == len(set(ids))
+    assert set(ids) == expected
@@ -0,0 +1,129 @@
+"""Tests of the incremental ingestion of the usage statistics and its watermark."""
+import json
+from datetime import date
+
+import pytest
+
+pytest.importorskip("pyarrow", exc_type=ImportError)
+
+from shared import blob_download  # noqa: E402
+from shared.usage_statistics import (  # noqa: E402
+    CHAT_FOLDER,
+    UsageWatermark,
+    ingest,
+    list_new_blobs,
+)
+
+TODAY = date(2025, 11, 14)
+
+
+class FakeDownload:
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def readall(self) -> bytes:
+        return self.data
+
+
+class FakeContainerClient:
+    """Chat blobs in memory; downloads of the blobs in failing raise."""
+
+    def __init__(self):
+        self.blobs = {}
+        self.failing = set()
+        self.downloaded = []
+
+    def add_chat(self, day: str, hhmmss: str, user: str) -> str:
+        session_uuid = f"{day}{hhmmss}-{user}"
+        blob_name = f"{CHAT_FOLDER}{session_uuid}_{hhmmss}.json"
+        record = {
+            "environment": "prd",
+            "session_uuid": session_uuid,
+            "timestamp_last_chat": f"{day[:4]}-{day[4:6]}-{day[6:]} {hhmmss[:2]}:{hhmmss[2:4]}:{hhmmss[4:]}",
+            "conversation": [],
+            "hashed_user": user,
+        }
+        self.blobs[blob_name] = json.dumps(record).encode("utf-8")
+        return blob_name
+
+    def list_blob_names(self, name_starts_with: str = ""):
+        return sorted(name for name in self.blobs if name.startswith(name_starts_with))
+
+    def download_blob(self, blob_name: str) -> FakeDownload:
+        if blob_name in self.failing:
+            raise ConnectionError(f"Connection reset while downloading {blob_name}")
+        self.downloaded.append(blob_name)
+        return FakeDownload(self.blobs[blob_name])
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    """Retry failed downloads without waiting."""
+    monkeypatch.setattr(blob_download.time, "sleep", lambda seconds: None)
+
+
+def test_first_run_ingests_everything_before_today():
+    client = FakeContainerClient()
+    client.add_chat("20251101", "090000", "a")
+    client.add_chat("20251113", "100000", "b")
+    client.add_chat("20251114", "080000", "c")
+
+    rows, watermark = ingest(client, UsageWatermark(), TODAY)
+
+    assert sorted(rows["hashed_user"]) == ["a", "b"]
+    assert watermark.last_date == "20251113"
+    # only the prefixes in the lookback window are kept
+    assert list(watermark.blob_names) == ["20251113"]
+
+
+def test_next_run_only_ingests_new_blobs_including_late_ones_in_the_lookback_window():
+    client = FakeContainerClient()
+    client.add_chat("20251112", "090000", "a")
+    client.add_chat("20251113", "100000", "b")
+    _, watermark = ingest(client, UsageWatermark(), TODAY)
+
+    # a session of the day before yesterday that went on after midnight, and a new one
+    late = client.add_chat("20251112", "235900", "c")
+    new = client.add_chat("20251114", "120000", "d")
+    client.downloaded.clear()
+    rows, watermark = ingest(client, watermark, date(2025, 11, 15))
+
+    assert client.downloaded == [late, new]
+    assert sorted(rows["hashed_user"]) == ["c", "d"]
+    assert watermark.last_date == "20251114"
+
+
+def test_second_run_on_the_same_day_lists_nothing():
+    client = FakeContainerClient()
+    client.add_chat("20251113", "100000", "a")
+    _, watermark = ingest(client, UsageWatermark(), TODAY)
+
+    rows, watermark_again = ingest(client, watermark, TODAY)
+
+    assert rows.empty
+    assert watermark_again == watermark
+
+
+def test_failed_download_stays_new():
+    client = FakeContainerClient()
+    client.add_chat("20251105", "090000", "a")
+    failed = client.add_chat("20251106", "100000", "b")
+    client.add_chat("20251113", "110000", "c")
+    client.failing.add(failed)
+
+    rows, watermark = ingest(client, UsageWatermark(), TODAY)
+
+    assert sorted(rows["hashed_user"]) == ["a", "c"]
+    assert failed not in sum(watermark.blob_names.values(), [])
+    # also when the next run is long after the date of the failed blob
+    for today in [TODAY, date(2025, 11, 30)]:
+        assert failed in list_new_blobs(client, watermark, today)
+
+    client.failing.clear()
+    client.downloaded.clear()
+    rows, watermark = ingest(client, watermark, date(2025, 11, 15))
+
+    assert client.downloaded == [failed]
+    assert list(rows["hashed_user"]) == ["b"]
+    assert watermark.last_date == "20251114"
+    assert list_new_blobs(client, watermark, date(2025, 11, 16)) == []